@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for creating a batched Environment class. A batch environment
+holds N bike stations x E parallel episodes as NumPy arrays and steps all of
+them one hour at a time with the same rules as env.env:
+    1) reset: reset all stations and episodes for a new day
+    2) step: take an (N, E) array of action indices, update the stocks and
+             return arrays of stock info, reward and termination status
+    3) observe: return the (old stock, expected stock) arrays an agent acts on
+
+"""
+
+import numpy as np
+from reward import reward_engine
+import json
+with open('EXPECTED_BALANCES.json') as json_data:
+    expected_balance = json.load(json_data)
+
+
+def station_stocks(IDs, mode, station_history = None):
+
+    '''
+    This function builds the hourly stock and expected stock matrices for a
+    list of stations.
+    Input:
+        - IDs: a list of station IDs (keys of EXPECTED_BALANCES.json)
+        - mode: linear, random, or actual
+        - station_history: dict of ID -> 24 hourly stocks (actual mode only)
+    Output:
+        - stocks: a (N, 24) int array of simulated hourly stock
+        - expected: a (N, 24) float array of expected stock, NaN in hour 23
+    '''
+
+    stocks = np.zeros((len(IDs), 24), dtype = np.int64)
+    expected = np.full((len(IDs), 24), np.nan)
+
+    for i, ID in enumerate(IDs):
+
+        if mode == "actual":
+            stocks[i] = station_history[ID]
+        elif mode == "random":
+            steps = 3 + np.random.randint(-5, 6, size = 23)
+            stocks[i] = 20 + np.concatenate([[0], np.cumsum(steps)])
+        else:
+            stocks[i] = 20 + 3*np.arange(24)
+
+        expected[i, :23] = expected_balance[str(ID)]
+
+    return stocks, expected
+
+
+class batch_env():
+
+    def __init__(self, stocks, expected, n_episodes = 1, fuel_cost = 0.5, debug = False):
+
+        print("Creating A Batch Bike Environment...")
+
+        # (N, hours) base series; rebalancing is tracked as per-episode offsets
+        self.bike_stock_sim = np.asarray(stocks, dtype = np.int64)
+        self.exp_bike_stock_sim = np.asarray(expected, dtype = np.float64)
+        self.n_stations, self.n_hours = self.bike_stock_sim.shape
+        self.n_episodes = n_episodes
+        self.last_hour = self.n_hours - 1
+        self.fuel_cost = fuel_cost
+        self.debug = debug
+
+        # Set the max and min thresholds
+        self.max_threshold = 50
+        self.max_target = 35
+        self.min_target = 15
+
+        self.actions = np.array([-10, -3, -1, 0])
+        self.n_actions = len(self.actions)
+        self.n_features = 1
+        self.rewards = reward_engine(self.actions, fuel_cost, self.min_target,
+                                     self.max_target, self.max_threshold)
+
+        self.reset()
+
+    def reset(self):
+
+        if self.debug == True:
+            print("Reset Batch Environment ...")
+
+        shape = (self.n_stations, self.n_episodes)
+        self.current_hour = 0
+        self.offset = np.zeros(shape, dtype = np.int64)       # applies to current hour
+        self.next_offset = np.zeros(shape, dtype = np.int64)  # applies to later hours
+        self.reward = np.zeros(shape)
+        self.bike_moved = np.zeros(shape, dtype = np.int64)
+        self.old_stock = self.bike_stock_sim[:, 0, None] + self.offset
+        self.new_stock = np.zeros(shape, dtype = np.int64)
+        self.done = False
+
+        return self.observe()
+
+    def observe(self):
+
+        '''
+        Return the (old stock, expected stock) arrays for the current hour,
+        i.e. the batched equivalent of env.get_old_stock/get_expected_stock.
+        '''
+
+        h = self.current_hour
+        stock = self.bike_stock_sim[:, h, None] + self.offset
+        expected = self.exp_bike_stock_sim[:, h, None] + self.offset
+
+        return stock, expected
+
+    def current_stock(self):
+
+        return self.bike_stock_sim[:, self.current_hour, None] + self.offset
+
+    def step(self, actions):
+
+        '''
+        Move every station/episode forward by one hour.
+        Input:
+            - actions: an (N, E) int array of indices into self.actions
+        Output:
+            - current_hour, old_stock, new_stock, expected_stock,
+              expected_stock_new, reward, done (same order as env.ping)
+        '''
+
+        h = self.current_hour
+        index = np.asarray(actions)
+        move = self.actions[index]
+
+        if h != self.last_hour:
+            self.next_offset = self.next_offset + move
+            self.bike_moved = np.where(move != 0, move, self.bike_moved)
+
+        stock = self.bike_stock_sim[:, h, None] + self.offset
+
+        # a move keeps the fuel cost as reward unless a penalty applies, no
+        # move carries the previous reward over (see reward.py)
+        self.reward = self.rewards.evaluate(h == self.last_hour, stock, index, self.reward)
+
+        if h == self.last_hour:
+            self.done = True
+
+            return h, self.old_stock, self.new_stock, np.full(stock.shape, np.nan), \
+                np.full(stock.shape, np.nan), self.reward, self.done
+
+        expected_stock = self.exp_bike_stock_sim[:, h, None] + self.offset
+        self.current_hour += 1
+        self.offset = self.next_offset.copy()
+        self.old_stock = stock
+        self.new_stock = self.bike_stock_sim[:, h + 1, None] + self.offset
+        expected_stock_new = self.exp_bike_stock_sim[:, h + 1, None] + self.offset
+
+        if self.debug == True:
+            print("Tick... Forwarded Current Hour to {}".format(self.current_hour))
+
+        return self.current_hour, self.old_stock, self.new_stock, expected_stock, \
+            expected_stock_new, self.reward, self.done
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is a microbenchmark suite for the hot paths of the program:
+    - env_ping / env_ping_dqn: environment steps per second
+    - batch_env_step: station-hours per second of the batched environment
+    - agent_choose_learn: Q-learning choose_action + learn updates per second
+    - q_table_growth: seconds per check_state_exist of a new state
+    - dqn_learn: DeepQNetwork.learn steps per second (needs TensorFlow)
+    - train_operator: end-to-end Q-learning episodes per second
+
+Results are written as JSON so runs can be compared across commits:
+    python benchmarks.py --output bench.json
+    python benchmarks.py --quick --only env_ping agent_choose_learn
+
+"""
+
+from contextlib import redirect_stdout
+import subprocess
+import tempfile
+import platform
+import argparse
+import datetime
+import json
+import time
+import io
+import os
+import numpy as np
+
+
+def timed(function, repeat):
+
+    # best of `repeat` runs of function(), in seconds
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start_time)
+
+    return best
+
+
+def bench_env_ping(n_steps, repeat, dqn = False):
+
+    from env import env
+
+    with redirect_stdout(io.StringIO()):
+        station = env('linear', debug = False, ID = 497, station_history = None)
+    actions = np.random.randint(0, len(station.actions), size = n_steps)
+
+    def run():
+        station.reset()
+        for index in actions:
+            if dqn:
+                done = station.ping_dqn(index)[4]
+            else:
+                done = station.ping(station.actions[index])[6]
+            if done:
+                station.reset()
+
+    return {"value": n_steps / timed(run, repeat), "unit": "steps/s"}
+
+
+def bench_batch_env_step(n_episodes, repeat):
+
+    from batch_env import batch_env, station_stocks
+
+    with open('EXPECTED_BALANCES.json') as json_data:
+        IDs = list(json.load(json_data).keys())
+
+    with redirect_stdout(io.StringIO()):
+        stocks, expected = station_stocks(IDs, 'linear')
+        stations = batch_env(stocks, expected, n_episodes = n_episodes)
+    actions = np.random.randint(0, stations.n_actions, size = (stations.n_hours,) + stations.offset.shape)
+
+    def run():
+        stations.reset()
+        for hour in range(stations.n_hours):
+            stations.step(actions[hour])
+
+    station_hours = stations.n_hours * stations.n_stations * n_episodes
+    return {"value": station_hours / timed(run, repeat), "unit": "station-hours/s"}
+
+
+def bench_agent_choose_learn(n_steps, repeat, model_based = False):
+
+    from rl_brain import agent
+
+    def run():
+        with redirect_stdout(io.StringIO()):
+            operator = agent(epsilon = 0.9, lr = 0.001, gamma = 0.9, current_stock = 20,
+                             debug = False, expected_stock = 20, model_based = model_based)
+        stocks = np.random.randint(-20, 80, size = n_steps + 1)
+        for i in range(n_steps):
+            action = operator.choose_action(stocks[i], stocks[i + 1])
+            operator.learn(stocks[i], action, -1.0, stocks[i + 1], stocks[i + 1], False)
+
+    return {"value": n_steps / timed(run, repeat), "unit": "updates/s"}
+
+
+def bench_q_table_growth(n_states, repeat):
+
+    from rl_brain import agent
+
+    with redirect_stdout(io.StringIO()):
+        operator = agent(epsilon = 0.9, lr = 0.001, gamma = 0.9, current_stock = 20,
+                         debug = False, expected_stock = 20, model_based = False)
+
+    def run():
+        # new states on both sides of the table, as from a drifting stock
+        base = len(operator.q_table) * 10 + 1000
+        for i in range(n_states):
+            operator.check_state_exist(base + i if i % 2 else -base - i)
+
+    return {"value": timed(run, repeat) / n_states, "unit": "s/state"}
+
+
+def bench_dqn_learn(n_steps, repeat, batch_size = 32):
+
+    try:
+        import dqn
+    except ImportError as ex:
+        return {"value": None, "unit": "steps/s", "error": str(ex)}
+
+    with redirect_stdout(io.StringIO()):
+        value = max(dqn.benchmark_learn(batch_size, n_steps) for _ in range(repeat))
+
+    return {"value": value, "unit": "steps/s", "batch_size": batch_size}
+
+
+def bench_train_operator(n_episodes, repeat, model_based = False):
+
+    from training import trainer
+
+    # nothing is written: no episode log, no charts, and a throwaway output_dir
+    def run():
+        with redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as output_dir:
+            session = trainer(None, output_dir = output_dir, log_every = 0, charts = False)
+            session.configure('linear', False, False, False, 'q', 497, model_based)
+            session.episodes = [n_episodes]
+            session.create_session()
+            session.train_operator(0, 1, n_episodes, logging = False, brain = 'q',
+                                   model_based = model_based)
+
+    return {"value": n_episodes / timed(run, repeat), "unit": "episodes/s"}
+
+
+def git_commit():
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr = subprocess.DEVNULL,
+                                       cwd = os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(quick = False, only = None):
+
+    scale = 0.1 if quick else 1
+    repeat = 1 if quick else 3
+    benchmarks = {
+        "env_ping": lambda: bench_env_ping(int(100000*scale), repeat),
+        "env_ping_dqn": lambda: bench_env_ping(int(100000*scale), repeat, dqn = True),
+        "batch_env_step": lambda: bench_batch_env_step(max(1, int(64*scale)), repeat),
+        "agent_choose_learn": lambda: bench_agent_choose_learn(int(50000*scale), repeat),
+        "agent_choose_learn_fct": lambda: bench_agent_choose_learn(int(50000*scale), repeat, True),
+        "q_table_growth": lambda: bench_q_table_growth(int(10000*scale), repeat),
+        "dqn_learn": lambda: bench_dqn_learn(int(200*scale), repeat),
+        "train_operator": lambda: bench_train_operator(int(2000*scale), repeat),
+    }
+
+    results = {}
+    for name, bench in benchmarks.items():
+        if only is not None and name not in only:
+            continue
+        np.random.seed(0)
+        results[name] = bench()
+        print("{}: {} {}".format(name, results[name]["value"], results[name]["unit"]))
+
+    return {"commit": git_commit(),
+            "timestamp": str(datetime.datetime.now()),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "quick": quick,
+            "results": results}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Benchmark env, agent and trainer hot paths.")
+    parser.add_argument("--output", default = "benchmark_results.json")
+    parser.add_argument("--quick", action = "store_true", help = "smaller and fewer runs")
+    parser.add_argument("--only", nargs = "+", default = None, help = "benchmark names to run")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.quick, args.only)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 2)
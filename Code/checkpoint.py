@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for saving and restoring the training state of a session:
+    - save_checkpoint: writes a flat dict of NumPy arrays to a compressed
+      .npz file atomically (temporary file, fsync, then os.replace), so a
+      crash while writing leaves the previous checkpoint intact
+    - load_checkpoint: reads it back without pickle
+    - nest / unnest: prefix the keys of one component's state, e.g. the
+      agent's arrays are stored as "agent/q_table/values"
+    - get_random_state / set_random_state: the global NumPy random state
+    - json_array / from_json_array: small nested values (e.g. a Generator
+      state) stored as a string array
+
+Every stateful class of the training loop (q_table, replay_buffer,
+DeepQNetwork, agent, planner, env, episode_history, convergence_monitor,
+phase_timer) has get_state() / set_state(state) over such dicts.
+
+"""
+
+import numpy as np
+import json
+import os
+
+
+def save_checkpoint(fname, state):
+
+    '''
+    Input:
+        - fname: checkpoint file (.npz)
+        - state: dict of NumPy arrays (or values np.asarray accepts)
+    '''
+
+    folder = os.path.dirname(fname)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok = True)
+
+    temp = fname + ".tmp"
+    with open(temp, 'wb') as f:
+        np.savez_compressed(f, **{key: np.asarray(value) for key, value in state.items()})
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, fname)
+
+
+def load_checkpoint(fname):
+
+    with np.load(fname, allow_pickle = False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def nest(prefix, state):
+
+    return {prefix + "/" + key: value for key, value in state.items()}
+
+
+def unnest(prefix, state):
+
+    start = len(prefix) + 1
+    return {key[start:]: value for key, value in state.items() if key.startswith(prefix + "/")}
+
+
+def json_array(value):
+
+    return np.array(json.dumps(value))
+
+
+def from_json_array(array):
+
+    return json.loads(str(array))
+
+
+def get_random_state():
+
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+
+    return {"keys": keys, "pos": pos, "has_gauss": has_gauss, "cached_gaussian": cached_gaussian}
+
+
+def set_random_state(state):
+
+    np.random.set_state(("MT19937", state["keys"], int(state["pos"]), int(state["has_gauss"]),
+                         float(state["cached_gaussian"])))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for stopping a training session once it has converged:
+    - convergence_monitor: collects episode rewards and final stocks in
+      windows of `window` episodes. At the end of each window it compares
+      with the previous window
+        1) the mean episode reward
+        2) the success ratio as in trainer.cal_performance
+        3) the change of the Q table / DQN weights over the window,
+           relative to their size (<= q_tol)
+      and asks to stop after `patience` stable windows in a row. Rewards and
+      success ratios of exploring agents are noisy, so 1) and 2) count as
+      stable when the change is within reward_tol (relative) / success_tol
+      (percentage points) or within `z` standard errors of the difference.
+
+get_state() / set_state() checkpoint the monitor mid-session.
+
+Example:
+    monitor = convergence_monitor(window = 100, patience = 3)
+    if monitor.update(reward, final_stock):      # end of a window
+        stop = monitor.check(agent.parameter_change(snapshot))
+
+"""
+
+import numpy as np
+
+
+class convergence_monitor():
+
+    def __init__(self, window = 100, patience = 3, reward_tol = 0.05, success_tol = 2.0,
+                 q_tol = 0.05, z = 2.0, min_episodes = 0):
+
+        self.window = window
+        self.patience = patience
+        self.reward_tol = reward_tol
+        self.success_tol = success_tol
+        self.q_tol = q_tol
+        self.z = z
+        self.min_episodes = min_episodes
+
+        self.episode = 0            # episodes seen so far
+        self.reward_sum = 0.0       # sums over the running window
+        self.reward_sq = 0.0
+        self.successes = 0
+        self.last = None            # (mean, variance, success ratio) of the previous window
+        self.stable = 0             # stable windows in a row
+        self.stopped_at = None      # episode count when training was stopped
+        self.windows = []           # [(episodes, mean reward, success %, q change), ...]
+
+
+    def update(self, reward, final_stock):
+
+        '''
+        Input:
+            - reward, final_stock: outcome of one episode
+        Output:
+            - True at the end of a window (call check() next)
+        '''
+
+        self.episode += 1
+        self.reward_sum += reward
+        self.reward_sq += reward*reward
+        if 0 < final_stock <= 50:
+            self.successes += 1
+
+        return self.episode % self.window == 0
+
+
+    def check(self, q_change):
+
+        '''
+        Input:
+            - q_change: relative change of the learned values over the window
+        Output:
+            - True if training can stop
+        '''
+
+        n = self.window
+        mean = self.reward_sum / n
+        variance = max(0.0, self.reward_sq / n - mean*mean)
+        success = self.successes*100 / n
+        self.windows.append((self.episode, mean, success, q_change))
+        self.reward_sum = 0.0
+        self.reward_sq = 0.0
+        self.successes = 0
+
+        if self.last is not None:
+            last_mean, last_variance, last_success = self.last
+            p = (success + last_success) / 200
+            reward_noise = self.z*np.sqrt((variance + last_variance) / n)
+            success_noise = self.z*100*np.sqrt(2*p*(1 - p) / n)
+            stable = (abs(mean - last_mean) <= max(self.reward_tol*abs(last_mean), reward_noise)) and \
+                     (abs(success - last_success) <= max(self.success_tol, success_noise)) and \
+                     (q_change <= self.q_tol)
+            self.stable = self.stable + 1 if stable else 0
+        self.last = (mean, variance, success)
+
+        if self.stable >= self.patience and self.episode >= self.min_episodes:
+            self.stopped_at = self.episode
+            return True
+
+        return False
+
+
+    def get_state(self):
+
+        return {"episode": np.array(self.episode), "reward_sum": np.array(self.reward_sum),
+                "reward_sq": np.array(self.reward_sq), "successes": np.array(self.successes),
+                "last": np.array(self.last if self.last is not None else [], dtype = np.float64),
+                "stable": np.array(self.stable),
+                "stopped_at": np.array(self.stopped_at if self.stopped_at is not None else -1),
+                "windows": np.array(self.windows, dtype = np.float64).reshape(-1, 4)}
+
+
+    def set_state(self, state):
+
+        self.episode = int(state["episode"])
+        self.reward_sum = float(state["reward_sum"])
+        self.reward_sq = float(state["reward_sq"])
+        self.successes = int(state["successes"])
+        self.last = tuple(float(x) for x in state["last"]) if len(state["last"]) > 0 else None
+        self.stable = int(state["stable"])
+        self.stopped_at = int(state["stopped_at"]) if int(state["stopped_at"]) >= 0 else None
+        self.windows = [(int(w[0]), float(w[1]), float(w[2]), float(w[3])) for w in state["windows"]]
+
+
+    def summary(self):
+
+        return {"stopped_at": self.stopped_at, "episodes": self.episode, "windows": self.windows}
@@ -1,9 +1,27 @@
 """
 
+This script is for creating a Deep Q Network class. It has the following 
+methods:
+    1) store_transition(s): save (s, a, r, s_, done) transitions to the 
+              replay buffer (see replay_buffer.py)
+    2) choose_action / choose_actions: epsilon-greedy action(s) from one 
+              compiled inference pass of the evaluation network
+    3) learn: one graph-compiled (XLA where available) training step on a 
+              batch sampled from memory
+    4) get_state / set_state: eval/target network variables (including
+              BatchNormalization statistics and dropout seeds), optimizer
+              slots, replay memory and counters as arrays for checkpointing
+    
+benchmark_learn() measures learn steps per second for a given batch size:
+    python dqn.py
+
 """
 
+import time
 import numpy as np
 import tensorflow as tf
+from replay_buffer import replay_buffer, prioritized_replay_buffer
+from checkpoint import nest, unnest
 from tensorflow import keras
 from tensorflow.keras import layers, Sequential
 
@@ -16,9 +34,11 @@ class DeepQNetwork:
         reward_decay=0.9,
         e_greedy=0.9,
         replace_target_iter=10,
-        batch_size=5,
+        batch_size=32,
         e_greedy_increment=None,
         memory_size=100,
+        jit_compile=True,
+        prioritized=False,
     ):
         self.n_actions = n_actions
         self.n_features = n_features
@@ -33,8 +53,11 @@ class DeepQNetwork:
         self.hourly_stock_history = []
         self.learn_step_counter = 0
         
-        self.memory_counter = 20
-        self.memory = np.zeros((memory_size, n_features * 2 + 2))
+        # Replay memory (uniform or prioritized sampling)
+        if prioritized:
+            self.memory = prioritized_replay_buffer(memory_size, n_features)
+        else:
+            self.memory = replay_buffer(memory_size, n_features)
         
         # Build evaluation and target networks
         self.eval_net = self._build_net('eval_net')
@@ -42,6 +65,38 @@ class DeepQNetwork:
         
         self.optimizer = tf.keras.optimizers.RMSprop(learning_rate)
         
+        # Graph-compiled training step; falls back to plain tf.function if
+        # XLA is not available on this host
+        self.jit_compile = jit_compile
+        self.train_step = self._compile_train_step(jit_compile)
+        
+        # Compiled inference-mode forward pass shared by all acting paths
+        self.predict_step = tf.function(lambda observations: self.eval_net(observations, training=False),
+                                        reduce_retracing=True)
+        
+    def _compile_train_step(self, jit_compile):
+        
+        def train_step(states, actions, rewards, next_states, dones, weights):
+            q_next = self.target_net(next_states)
+            q_target = rewards + self.gamma * tf.reduce_max(q_next, axis=1) * (1.0 - dones)
+            
+            with tf.GradientTape() as tape:
+                q_eval = self.eval_net(states)
+                q_eval_wrt_a = tf.gather(q_eval, actions, batch_dims=1)
+                td_errors = q_target - q_eval_wrt_a
+                loss = tf.reduce_mean(weights * tf.square(td_errors))
+            
+            gradients = tape.gradient(loss, self.eval_net.trainable_variables)
+            self.optimizer.apply_gradients(zip(gradients, self.eval_net.trainable_variables))
+            return td_errors
+        
+        return tf.function(train_step, jit_compile=jit_compile, reduce_retracing=True)
+    
+    def replace_target_params(self):
+        # copy eval_net weights into target_net without a NumPy round trip
+        for target, source in zip(self.target_net.weights, self.eval_net.weights):
+            target.assign(source)
+        
     def _build_net(self, name):
         model = keras.Sequential(name=name)
         model.add(layers.Input(shape=(self.n_features,)))
@@ -58,19 +113,21 @@ class DeepQNetwork:
     
     
     
-    def store_transition(self, s, a, r, s_):
-        if not hasattr(self, 'memory_counter'):
-            self.memory_counter = 0
-        transition = np.hstack((s, [a, r], s_))
-        index = self.memory_counter % self.memory_size
-        self.memory[index, :] = transition
-        self.memory_counter += 1
+    def store_transition(self, s, a, r, s_, done=False):
+        self.memory.store(s, a, r, s_, done)
+    
+    def store_transitions(self, s, a, r, s_, done):
+        # bulk insert of one step of many environments
+        self.memory.store_batch(s, a, r, s_, done)
+    
+    def predict(self, observations):
+        # Q values of a (batch, n_features) array of observations
+        observations = np.asarray(observations, dtype=np.float32).reshape(-1, self.n_features)
+        return self.predict_step(observations).numpy()
     
     def choose_action(self, observation):
-        observation = np.expand_dims(observation, axis=0)
-        
         if np.random.uniform() < self.epsilon:
-            actions_value = self.eval_net(observation).numpy()
+            actions_value = self.predict(observation)
             action = np.argmax(actions_value)
         else:
             action = np.random.randint(0, self.n_actions)
@@ -78,34 +135,51 @@ class DeepQNetwork:
         self.hourly_stock_history.append(action)
         return action
     
+    def choose_actions(self, observations, epsilon=None):
+        
+        '''
+        Epsilon-greedy actions for a batch of observations (e.g. many parallel
+        environments or stations) with one forward pass.
+        Input:
+            - observations: array of shape (batch, n_features), or any shape
+                            of scalar observations when n_features is 1
+        Output:
+            - actions: int array of action indices, one per observation
+        '''
+        
+        epsilon = self.epsilon if epsilon is None else epsilon
+        observations = np.asarray(observations, dtype=np.float32)
+        shape = observations.shape[:-1] if self.n_features > 1 else observations.shape
+        observations = observations.reshape(-1, self.n_features)
+        
+        actions = np.random.randint(0, self.n_actions, size=len(observations))
+        greedy = np.random.uniform(size=len(observations)) < epsilon
+        if greedy.any():
+            actions[greedy] = np.argmax(self.predict(observations[greedy]), axis=1)
+        
+        return actions.reshape(shape)
+    
     def learn(self):
         if self.learn_step_counter % self.replace_target_iter == 0:
-            self.target_net.set_weights(self.eval_net.get_weights())
+            self.replace_target_params()
             print("\nTarget network parameters replaced\n")
 
         # Sample memory
-        if self.memory_counter > self.memory_size:
-            sample_index = np.random.choice(self.memory_size, size=self.batch_size)
-        else:
-            sample_index = np.random.choice(self.memory_counter, size=self.batch_size)
-        batch_memory = self.memory[sample_index, :]
+        index, batch, weights = self.memory.sample(self.batch_size)
+        batch = [tf.constant(column) for column in batch] + [tf.constant(weights)]
 
-        states = batch_memory[:, :self.n_features]
-        actions = batch_memory[:, self.n_features]
-        rewards = batch_memory[:, self.n_features + 1]
-        next_states = batch_memory[:, -self.n_features:]
-
-        q_next = self.target_net(next_states)
-        q_target = rewards + self.gamma * tf.reduce_max(q_next, axis=1)
-
-        with tf.GradientTape() as tape:
-            q_eval = self.eval_net(states)
-            a_indices = tf.stack([tf.range(self.batch_size), actions], axis=1)
-            q_eval_wrt_a = tf.gather_nd(q_eval, a_indices)
-            loss = tf.reduce_mean((q_target - q_eval_wrt_a) ** 2)
+        try:
+            td_errors = self.train_step(*batch)
+        except tf.errors.OpError:
+            if not self.jit_compile:
+                raise
+            # XLA could not compile the step on this host
+            print("XLA unavailable, using tf.function without jit_compile")
+            self.jit_compile = False
+            self.train_step = self._compile_train_step(False)
+            td_errors = self.train_step(*batch)
         
-        gradients = tape.gradient(loss, self.eval_net.trainable_variables)
-        self.optimizer.apply_gradients(zip(gradients, self.eval_net.trainable_variables))
+        self.memory.update_priorities(index, td_errors.numpy())
         
         # Safely increment epsilon
         if self.epsilon_increment is not None:
@@ -114,12 +188,67 @@ class DeepQNetwork:
 
         self.learn_step_counter += 1
         
+    def get_state(self):
+        state = {"learn_step_counter": np.array(self.learn_step_counter),
+                 "epsilon": np.array(self.epsilon)}
+        for name, variables in [("eval", self.eval_net.variables),
+                                ("target", self.target_net.variables),
+                                ("optimizer", self.optimizer.variables)]:
+            for i, variable in enumerate(variables):
+                state[name + "_" + str(i)] = variable.numpy()
+        state.update(nest("memory", self.memory.get_state()))
+        return state
+    
+    def set_state(self, state):
+        # the optimizer creates its slot variables on the first step
+        if any(key.startswith("optimizer_") for key in state) and \
+                len(self.optimizer.variables) < sum(key.startswith("optimizer_") for key in state):
+            self.optimizer.build(self.eval_net.trainable_variables)
+        for name, variables in [("eval", self.eval_net.variables),
+                                ("target", self.target_net.variables),
+                                ("optimizer", self.optimizer.variables)]:
+            for i, variable in enumerate(variables):
+                variable.assign(state[name + "_" + str(i)])
+        self.learn_step_counter = int(state["learn_step_counter"])
+        self.epsilon = float(state["epsilon"])
+        self.memory.set_state(unnest("memory", state))
+    
     def get_hourly_stocks(self):
         return self.hourly_stock_history
     
     def reset_hourly_history(self):
         self.hourly_stock_history = []
 
-# Example usage
+def benchmark_learn(batch_size=32, n_steps=200, n_features=1, n_actions=4, jit_compile=True,
+                    memory_size=1000, prioritized=False):
+    
+    '''
+    This function measures DeepQNetwork.learn throughput on random transitions.
+    Output:
+        - learn steps per second (after one warm-up step that traces/compiles)
+    '''
+    
+    net = DeepQNetwork(n_actions, n_features, batch_size=batch_size, memory_size=memory_size,
+                       jit_compile=jit_compile, prioritized=prioritized)
+    net.store_transitions(np.random.uniform(0, 50, (memory_size, n_features)),
+                          np.random.randint(n_actions, size=memory_size),
+                          np.random.uniform(-100, 0, memory_size),
+                          np.random.uniform(0, 50, (memory_size, n_features)),
+                          np.zeros(memory_size))
+    net.replace_target_iter = n_steps + 1 # keep the target sync out of the timing
+    net.learn()
+    
+    start_time = time.perf_counter()
+    for _ in range(n_steps):
+        net.learn()
+    
+    return n_steps / (time.perf_counter() - start_time)
+
+
 if __name__ == '__main__':
-    DQN = DeepQNetwork(3, 4)
\ No newline at end of file
+    for batch_size in [5, 32, 128, 512]:
+        print("Batch Size: {} | Learn Steps per Second: {:.1f}".format(batch_size, 
+              benchmark_learn(batch_size)))
+    for memory_size in [1000, 100000]:
+        print("Prioritized Memory: {} | Learn Steps per Second: {:.1f}".format(memory_size, 
+              benchmark_learn(32, memory_size=memory_size, prioritized=True)))
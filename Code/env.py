@@ -9,12 +9,14 @@ a bike station with the following methods:
                 and episode termination status; iterate to new hour
     3) update: this updates the bike stock based on RL Agent Action
     4) reset: reset all environment properties for new episode training
+    5) get_state / set_state: the simulated stock series, for checkpoints
+       taken between episodes
 
 """
 
 import numpy as np
-import pandas as pd
 import json
+from reward import reward_engine
 with open('EXPECTED_BALANCES.json') as json_data:
     expected_balance = json.load(json_data)
 
@@ -26,7 +28,6 @@ class env():
         
         self.mode = mode
         self.seed = np.random.random_integers(0, 10)
-        self.num_hours = 23
         self.current_hour = 0
         
         # Set the max and min thresholds
@@ -39,8 +40,13 @@ class env():
         else:
             self.bike_stock_sim = self.generate_stock(mode, ID)
             
-        self.bike_stock = self.bike_stock_sim.copy() # to be reset to original copy every episode
-        self.old_stock = self.bike_stock[0]
+        # bike_stock_sim is never modified; rebalancing is tracked as offsets
+        # so that the stock at an hour is bike_stock_sim[hour] + offset
+        self.num_hours = len(self.bike_stock_sim) - 1 # index of the last hour
+        self.offset = 0         # bikes moved before the current hour
+        self.next_offset = 0    # bikes moved up to and including the current hour
+        self.moves = []         # (hour, bikes) of every move in this episode
+        self.old_stock = self.bike_stock_sim[0]
         self.new_stock = 0
         self.done = False
         self.reward = 0
@@ -51,12 +57,17 @@ class env():
         #exp_bike_stock is list of expected balances in next hour
         #Predictions based on Random Forests model
         self.exp_bike_stock_sim = list(np.append(expected_balance[self.ID], None)) 
-        self.exp_bike_stock = self.exp_bike_stock_sim.copy()
-        self.expected_stock = self.exp_bike_stock[0]
+        self.expected_stock = self.exp_bike_stock_sim[0]
         self.expected_stock_new = 0
 
         self.actions = [-10, -3, -1, 0]
         self.n_actions = len(self.actions)
+        
+        # reward tables of ping (fuel cost 0.5/bike) and ping_dqn (0.2/bike)
+        self.ping_rewards = reward_engine(self.actions, 0.5, self.min_target, 
+                                          self.max_target, self.max_threshold)
+        self.ping_dqn_rewards = reward_engine(self.actions, 0.2, self.min_target,
+                                              self.max_target, self.max_threshold)
         #features of the observation: hour, old stock, new stock
         self.n_features = 1
 
@@ -66,7 +77,7 @@ class env():
         
         if self.debug == True:
             print("Generating Bike Stock: {}".format(self.mode))
-            print("Bike Stock: {}".format(self.bike_stock))
+            print("Bike Stock: {}".format(self.get_sim_stock()))
         
     def generate_stock(self, mode, ID):
         
@@ -94,7 +105,7 @@ class env():
         # share back t+1 stock, reward of t, and termination status
         if self.debug == True:
             print("Current Hour: {}".format(self.current_hour))
-            print("Current Stock: {}".format(self.bike_stock[self.current_hour]))
+            print("Current Stock: {}".format(self.current_stock()))
             print("Bikes Moved in Last Hour: {}".format(self.bike_moved))
             print("Collect {} rewards".format(self.reward))
             print("Will move {} bikes".format(action))
@@ -103,37 +114,20 @@ class env():
         action = self.actions[index]
         if action != 0:
             self.update_stock(action)
-            self.reward = -0.2*np.abs(action)
-            
-        if self.bike_stock[self.current_hour] > self.max_target:
-            if self.bike_stock[self.current_hour] > self.max_threshold:
-                self.reward = -100
-            else:
-                self.reward = -20
             
+        stock = self.current_stock()
+        terminal = self.current_hour == self.num_hours
         
-        if self.bike_stock[self.current_hour] < self.min_target:
-            if self.bike_stock[self.current_hour] < 0:
-                self.reward = -100
-            else:
-                self.reward = -20
-        
-        if self.current_hour == 23:
-            if (self.bike_stock[self.current_hour] <= self.max_threshold)&(self.bike_stock[self.current_hour] > 0):
-                if (self.bike_stock[self.current_hour] <= self.max_target)&(self.bike_stock[self.current_hour] >= self.min_target):
-                    self.reward = 500
-                else:
-                    self.reward = 100
-            
-            else: 
-                self.reward = -200
-                
+        # fuel cost, target/threshold penalties or final reward (see reward.py)
+        self.reward = self.ping_dqn_rewards.lookup(terminal, stock, index, self.reward)
+        
+        if terminal:
             self.done = True
 
-        if self.current_hour != 23:
+        if self.current_hour != self.num_hours:
             self.update_hour()
-            self.old_stock = self.bike_stock[self.current_hour - 1]
-            self.new_stock = self.bike_stock[self.current_hour]
+            self.old_stock = stock
+            self.new_stock = self.current_stock()
             
         return self.current_hour, self.old_stock, self.new_stock, self.reward, self.done
 
@@ -144,7 +138,7 @@ class env():
         # share back t+1 stock, reward of t, and termination status
         if self.debug == True:
             print("Current Hour: {}".format(self.current_hour))
-            print("Current Stock: {}".format(self.bike_stock[self.current_hour]))
+            print("Current Stock: {}".format(self.current_stock()))
             print("Bikes Moved in Last Hour: {}".format(self.bike_moved))
             print("Collect {} rewards".format(self.reward))
             print("Will move {} bikes".format(action))
@@ -152,42 +146,27 @@ class env():
         
         if action != 0:
             self.update_stock(action)
-            self.reward = -0.5*np.abs(action)
-            
-        if self.bike_stock[self.current_hour] > self.max_target:
-            if self.bike_stock[self.current_hour] > self.max_threshold:
-                self.reward = -100
-            else:
-                self.reward = -20
-            
-        if self.bike_stock[self.current_hour] < self.min_target:
-            if self.bike_stock[self.current_hour] < 0:
-                self.reward = -100
-            else:
-                self.reward = -20
-        
-        if self.current_hour == 23:
-            if (self.bike_stock[self.current_hour] <= self.max_threshold)&(self.bike_stock[self.current_hour] > 0):
-                if (self.bike_stock[self.current_hour] <= self.max_target)&(self.bike_stock[self.current_hour] >= self.min_target):
-                    self.reward = 500
-                else:
-                    self.reward = 100
-            
-            else: 
-                self.reward = -200
             
+        stock = self.current_stock()
+        terminal = self.current_hour == self.num_hours
+        
+        # fuel cost, target/threshold penalties or final reward (see reward.py)
+        self.reward = self.ping_rewards.lookup(terminal, stock, 
+                                               self.ping_rewards.action_index[action], self.reward)
+        
+        if terminal:
             self.done = True
             #self.new_stock = 'terminal'
             self.game_over = True
 
         # update to next hour
-        if self.current_hour != 23:
+        if self.current_hour != self.num_hours:
+            self.expected_stock = self.expected_at(self.current_hour)
             self.update_hour()
-            self.old_stock = self.bike_stock[self.current_hour - 1]
-            self.new_stock = self.bike_stock[self.current_hour]
-            self.expected_stock = self.exp_bike_stock[self.current_hour - 1]
-            if self.current_hour < 23:
-                self.expected_stock_new = self.exp_bike_stock[self.current_hour]
+            self.old_stock = stock
+            self.new_stock = self.current_stock()
+            if self.current_hour < self.num_hours:
+                self.expected_stock_new = self.expected_at(self.current_hour)
             
 
         return self.current_hour, self.old_stock, self.new_stock, self.expected_stock, self.expected_stock_new, self.reward, self.done, self.game_over
@@ -197,7 +176,7 @@ class env():
         return self.old_stock
 
     def get_expected_stock(self):
-        if self.current_hour < 23:
+        if self.current_hour < self.num_hours:
             return self.expected_stock
         else:
             return None
@@ -205,12 +184,11 @@ class env():
     def update_stock(self, num_bike):
         
         # update bike stock based on RL Agent action at t
-        if self.current_hour != 23:
-            for hour in range(self.current_hour+1, len(self.bike_stock)):
-                self.bike_stock[hour] += num_bike
-                if hour < len(self.bike_stock)-1:
-                    self.exp_bike_stock[hour] += num_bike
-                
+        # the move applies to every later hour, so only the running offset
+        # changes; bike_stock_sim itself is never rewritten
+        if self.current_hour != self.num_hours:
+            self.next_offset += num_bike
+            self.moves.append((self.current_hour, num_bike))
             self.bike_moved = num_bike
         
         else:
@@ -220,10 +198,29 @@ class env():
         
         return
     
+    def offset_at(self, hour):
+        
+        # total number of bikes moved before the given hour
+        if hour > self.current_hour:
+            return self.next_offset
+        if hour == self.current_hour:
+            return self.offset
+        return sum(num_bike for moved_hour, num_bike in self.moves if moved_hour < hour)
+    
+    def expected_at(self, hour):
+        
+        # expected stock at an hour, shifted by the bikes moved so far
+        # (the last hour has no forecast)
+        expected = self.exp_bike_stock_sim[hour]
+        if expected is None:
+            return None
+        return expected + self.offset_at(hour)
+    
     def update_hour(self):
         
         # update current_hour 
         self.current_hour += 1
+        self.offset = self.next_offset
         
         if self.debug == True:
             print("Tick... Forwarded Current Hour")
@@ -235,24 +232,39 @@ class env():
         if self.debug == True:
             print("Reset Environment ...")
         
-        self.num_hours = 23
         self.current_hour = 0
-        self.bike_stock = self.bike_stock_sim.copy()
-        self.exp_bike_stock = self.exp_bike_stock_sim.copy()
+        self.offset = 0
+        self.next_offset = 0
+        self.moves = []
         self.done = False
         self.reward = 0
         self.bike_moved = 0
-        self.old_stock = self.bike_stock[0]
+        self.old_stock = self.bike_stock_sim[0]
         self.new_stock = 0
-        self.expected_stock = self.exp_bike_stock[0]
+        self.expected_stock = self.exp_bike_stock_sim[0]
         self.expected_stock_new = 0
         #return (self.current_hour, self.old_stock, self.new_stock)
         
+    def get_state(self):
+        
+        # everything else is reset at the start of each episode (game_over
+        # is not: it stays True after the first episode ends)
+        return {"bike_stock_sim": np.array(self.bike_stock_sim), "seed": np.array(self.seed),
+                "game_over": np.array(self.game_over)}
+    
+    def set_state(self, state):
+        
+        self.bike_stock_sim = [int(stock) for stock in state["bike_stock_sim"]]
+        self.seed = int(state["seed"])
+        self.game_over = bool(state["game_over"])
+        self.reset()
+    
     def current_stock(self):
         
-        return self.bike_stock[self.current_hour]
+        return self.bike_stock_sim[self.current_hour] + self.offset
     
     def get_sim_stock(self):
         
-        return self.bike_stock 
+        # materialize the rebalanced hourly stock of the current episode
+        return [stock + self.offset_at(hour) for hour, stock in enumerate(self.bike_stock_sim)]
    
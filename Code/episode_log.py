@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for logging training episodes without per-episode I/O:
+    - episode_logger: buffers one row per episode (session, episode, final
+      stock, reward, method, station) in memory and appends them to a CSV
+      file in batches; console progress lines are printed for a sample of
+      the episodes only. tell() / truncate() let a resumed session drop
+      the rows written after its last checkpoint
+
+Example:
+    logger = episode_logger("episodes.csv", "QLN", 497, verbose = 1, print_every = 100)
+    logger.log(0, 1, eps, final_stock, reward)
+    logger.close()
+
+"""
+
+import os
+
+COLUMNS = ["session", "episode", "final_stock", "reward", "method", "station"]
+
+
+class episode_logger():
+
+    def __init__(self, fname, method, ID, buffer_size = 1000, verbose = 1, print_every = 100,
+                 log_every = 1, append = False):
+
+        '''
+        Input:
+            - fname: CSV file the rows are written to (None: console only)
+            - buffer_size: rows kept in memory between writes
+            - verbose: 0 = no console output, 1 = every print_every-th
+                       episode, 2 = every episode
+            - log_every: write every log_every-th episode to the file
+            - append: keep the rows already in the file (e.g. a resumed
+                      session); otherwise the file is started over
+        '''
+
+        self.fname = fname
+        self.method = method
+        self.ID = ID
+        self.buffer_size = buffer_size
+        self.verbose = verbose
+        self.print_every = max(1, print_every)
+        self.log_every = max(1, log_every)
+        self.rows = []
+        self.f = None
+
+        if fname is not None:
+            folder = os.path.dirname(fname)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder, exist_ok = True)
+            new_file = not append or not os.path.exists(fname) or os.path.getsize(fname) == 0
+            self.f = open(fname, 'a' if append else 'w')
+            if new_file:
+                self.f.write(",".join(COLUMNS) + "\n")
+
+
+    def log(self, session, num_sessions, episode, final_stock, reward):
+
+        if self.f is not None and episode % self.log_every == 0:
+            self.rows.append("{},{},{},{},{},{}\n".format(session, episode, final_stock, reward,
+                             self.method, self.ID))
+            if len(self.rows) >= self.buffer_size:
+                self.flush()
+
+        if self.verbose >= 2 or (self.verbose == 1 and episode % self.print_every == 0):
+            print("{} of {} Session | Episode: {} | Final Stock: {} |Final Reward: {:.2f}".format(
+                  session, num_sessions, episode, final_stock, reward))
+
+
+    def flush(self):
+
+        if self.f is not None and len(self.rows) > 0:
+            self.f.writelines(self.rows)
+            self.f.flush()
+        self.rows = []
+
+
+    def tell(self):
+
+        # size of the file once the buffered rows are written
+        self.flush()
+        return self.f.tell() if self.f is not None else 0
+
+
+    def truncate(self, size):
+
+        self.rows = []
+        if self.f is not None:
+            self.f.truncate(size)
+            self.f.seek(0, os.SEEK_END)
+
+
+    def close(self):
+
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        self.close()
+        return False
@@ -6,6 +6,7 @@
 
 import pandas as pd
 import numpy as np
+import ingest
 
 def user_input():
     
@@ -50,77 +51,53 @@ def user_input():
     return episode_list, data, ID, brain, model_based, station_history
 
 
-def citi_data_processing(ID):
+def citi_data_processing(ID, day = 0):
     
-    citi_df = process_citibike(20)
-    station_history = list(np.array(citi_df[citi_df['id'] == ID])[0][4:28])
-    return station_history
+    # hourly bike stock of one station on one day (index into the data)
+    return citi_station_histories([ID], day)[ID]
 
 
-def process_citibike(starting_bal):
+def citi_station_histories(IDs, day = 0):
+    
+    # process the CitiBike data once and slice one day of every station
+    # stations without trips in the data are left out
+    ids, _, balance = station_balances(20)
+    station_histories = {}
+    
+    # ids are sorted strings (ingest.station_ids), so 497 is looked up as "497"
+    for ID in IDs:
+        key = ingest.station_ids([ID]).iloc[0]
+        row = np.searchsorted(ids, key)
+        if row < len(ids) and ids[row] == key:
+            station_histories[ID] = list(balance[row, day])
+    
+    return station_histories
+
+
+def process_citibike(starting_bal, trip_file = ingest.TRIP_FILE):
         
-    # process real citi bike data from Sept 2017
+    # process real citi bike data (Sept 2017 by default; trip_file can also
+    # be a list of trip files, e.g. ingest.monthly_trip_files(start, end))
     # calculate bike stock based on inflow and outflow trips
     # return a pandas dataframe 
-        
+    
+    # hourly departures/arrivals per station come from the ingestion cache;
+    # only the first run reads (and, if needed, downloads) the trip file
     print("Loading data from CitiBike...")
-    bike = pd.read_csv("https://s3.amazonaws.com/tripdata/201709-citibike-tripdata.csv.zip")
-    bike['starttime'] = pd.to_datetime(bike['starttime'], infer_datetime_format= True)
-    bike['stoptime'] = pd.to_datetime(bike['stoptime'], infer_datetime_format= True)
-        
-    bike['day'] = bike['starttime'].dt.day
-    bike['start_hour'] = bike['starttime'].dt.hour
-    bike['end_hour'] = bike['stoptime'].dt.hour
-    bike['DOW'] = bike['starttime'].dt.dayofweek
-        
-    # Create a dataset with all unique station id, name, and lat/lon
-        
-    uni_dep_stations = bike[['start station id', 'start station name', 
-                         'start station latitude', 'start station longitude']].drop_duplicates()
-
-    uni_arv_stations = bike[['end station id', 'end station name', 
-                                 'end station latitude', 'end station longitude']].drop_duplicates()
-        
-    uni_dep_stations.columns = ["id", "name", "lat", "lon"]
-    uni_arv_stations.columns = ["id", "name", "lat", "lon"]
-    uni_station = pd.concat([uni_dep_stations, uni_arv_stations], axis = 0).drop_duplicates()
-    uni_station.head()
-        
-    # Create hourly departure count by day across the month
-    print("Calculating Departure and Arrivals ...")
-        
-    monthDep = pd.pivot_table(bike[['start station id', 'day','start_hour', 'starttime']],
-                                     index = "start station id", columns = ['day', "start_hour"], 
-                                     aggfunc = np.size, fill_value= 0).reset_index()
-        
-    monthDep.columns = ["dep_" + str(day) + "_" + str(hour) for _, day, hour in monthDep.columns]
-        
-        
-    # Create hourly arrival count by day across the month
-
-    monthArv = pd.pivot_table(bike[['end station id', 'day','end_hour', 'stoptime']],
-                                     index = "end station id", columns = ['day', "end_hour"], 
-                                     aggfunc = np.size, fill_value= 0).reset_index()
-        
-    monthArv.columns = ["arv_" + str(day) + "_" + str(hour) for _, day, hour in monthArv.columns]
+    flows = ingest.load_station_flows(trip_file)
         
     # Create a hourly net flow count by day across the month 
-
-    monthNet = uni_station.merge(monthDep, how = "left", left_on = "id", right_on = "dep__").\
-                              merge(monthArv, how = "left", left_on = "id", right_on = "arv__").fillna(0)
-        
-    for day in range(1, 31):
-                
-        for hour in range(0, 24):
-                
-            try:
-                net_col = "net_" + str(day) + "_" + str(hour)
-                dep_col = "dep_" + str(day) + "_" + str(hour)
-                arv_col = "arv_" + str(day) + "_" + str(hour)
-                monthNet[net_col] = monthNet[arv_col] - monthNet[dep_col]
-            except (KeyError):
-                print("Missing day: {} | Missing hour: {}".format(day, hour))
-                pass
+    print("Calculating Departure and Arrivals ...")
+    
+    num_days = flows["net"].shape[1]
+    net_cols = ["net_" + str(day) + "_" + str(hour) 
+                for day in range(1, num_days + 1) for hour in range(0, 24)]
+    
+    uni_station = pd.DataFrame({"id": flows["ids"], "name": flows["names"],
+                                "lat": flows["lat"], "lon": flows["lon"]})
+    monthNet = pd.concat([uni_station, 
+                          pd.DataFrame(flows["net"].reshape(len(flows["ids"]), -1), 
+                                       columns = net_cols)], axis = 1)
         
     # Create a dataframe of bike stock amount based on starting balance
     df_citibike = calHourlyBal(monthNet, starting_bal)
@@ -129,47 +106,58 @@ def process_citibike(starting_bal):
     
     
     
+def hourly_balance(net, starting_bal):
+    
+    '''
+    This function calculates the hourly bike balance of every station.
+    Input:
+        - net: a (station, day, 24) array of hourly net flows (arrivals - 
+               departures); missing time slots must be 0
+        - starting_bal: bike stock of every station at day 0 hour 0
+    Output:
+        - balance: a (station, day, 24) int array where the first slot is 
+                   starting_bal and every later slot adds its net flow
+    '''
+    
+    flat = np.asarray(net, dtype = np.int64).reshape(len(net), -1)
+    balance = starting_bal + np.cumsum(flat, axis = 1) - flat[:, :1]
+    
+    return balance.reshape(np.shape(net))
+
+
+def station_balances(starting_bal, trip_file = ingest.TRIP_FILE):
+    
+    # raw (station, day, 24) balance matrix with its station IDs and days,
+    # so single stations/days can be sliced without scanning a DataFrame
+    flows = ingest.load_station_flows(trip_file)
+    
+    return flows["ids"], flows["days"], hourly_balance(flows["net"], starting_bal)
+    
+    
 def calHourlyBal(df, starting_bal):
         
     print("Calculating Hourly Bike Stock for Each Station ...")
-    hourBal = df
-        
+    
+    # Collect the net flow columns into a station x (day, hour) matrix; 
+    # time slots without a net flow column are filled with 0 so that the 
+    # previous balance carries forward
+    days = sorted({int(col.split("_")[1]) for col in df.columns if str(col).startswith("net_")})
+    days = range(1, max(days) + 1) if len(days) > 0 else range(1, 31)
+    net_cols = ["net_" + str(day) + "_" + str(hour) for day in days for hour in range(0, 24)]
+    
+    missing = [col for col in net_cols if col not in df.columns]
+    if len(missing) > 0:
+        print("Missing net flow for {} time slots, filled with 0".format(len(missing)))
+    
+    net = df.reindex(columns = net_cols, fill_value = 0).values.reshape(len(df), len(days), 24)
+    
     # Calculate hourly bike balance based on starting stock
-    for day in range(1, 31):
-        for hour in range(0, 24):
-            try:
-                    
-                if day == 1 and hour == 0:
-                    bal_col = "bal_1_0"
-                    hourBal["bal_1_0"] = starting_bal
-                        
-                elif day > 1 and hour == 0:
-                        
-                    bal_col = "bal_" + str(day) + "_" + str(hour)
-                    last_bal_col = "bal_" + str(day-1) + "_23"
-                    net_col = "net_" + str(day) + "_0"
-                        
-                    hourBal[bal_col] = hourBal[last_bal_col] + hourBal[net_col]
-                    
-                else:
-                        
-                    bal_col = "bal_" + str(day) + "_" + str(hour)
-                    last_bal_col = "bal_" + str(day) + "_" + str(hour-1)
-                    net_col = "net_" + str(day) + "_" + str(hour)
-                                            
-                    hourBal[bal_col] = hourBal[last_bal_col] + hourBal[net_col]
-                
-            except (KeyError) as ex:
-                # use previous balance for missing time slot
-                print("Missing net flow at day {} hour {}".format(day, hour))
-                    
-                #hourBal[bal_col] = hourBal[last_bal_col]
-                pass
+    balance = hourly_balance(net, starting_bal)
         
     # Only keep balance and change columns
-    bal_col = hourBal.columns[hourBal.columns.str.contains("bal_")]
-    hourBal[bal_col] = hourBal[bal_col].astype('int')
-    final_bal = pd.concat([hourBal[["id", "name", "lat", "lon"]], hourBal[bal_col]], axis = 1) 
+    bal_col = ["bal_" + str(day) + "_" + str(hour) for day in days for hour in range(0, 24)]
+    hourBal = pd.DataFrame(balance.reshape(len(df), -1).astype('int'), columns = bal_col, 
+                           index = df.index)
+    final_bal = pd.concat([df[["id", "name", "lat", "lon"]], hourBal], axis = 1) 
         
     return final_bal
-
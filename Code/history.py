@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for storing per-episode hourly histories (bikes moved or
+bike stock at each hour) in preallocated integer arrays:
+    - hourly_buffer: one episode's hours, reused across episodes
+    - episode_history: (kept episodes, hours) array with a keep policy
+        'all':        every episode
+        'first_last': the first and the last episode only
+        'every':      every k-th episode (and the last one)
+        'reservoir':  the first, the last and a uniform reservoir sample of
+                      k episodes in between
+
+Memory is fixed when the store is created, so it stays bounded however many
+episodes a session runs, and kept() can be saved straight to .npy.
+get_state() / set_state() checkpoint a store mid-session.
+
+"""
+
+import numpy as np
+from checkpoint import json_array, from_json_array
+
+KEEP_MODES = ['all', 'first_last', 'every', 'reservoir']
+
+
+class hourly_buffer():
+
+    def __init__(self, hours = 24, dtype = np.int64):
+
+        self.values = np.zeros(hours, dtype = dtype)
+        self.length = 0
+
+
+    def append(self, value):
+
+        if self.length == len(self.values):
+            # more hours than expected (e.g. a longer history); double the buffer
+            self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+        self.values[self.length] = value
+        self.length += 1
+
+
+    def get(self):
+
+        return self.values[:self.length]
+
+
+    def reset(self):
+
+        self.length = 0
+
+
+class episode_history():
+
+    def __init__(self, episodes, hours = 24, keep = 'all', k = 100, dtype = np.int64,
+                 seed = None):
+
+        '''
+        Input:
+            - episodes: number of episodes that will be added
+            - hours: length of an episode
+            - keep: one of KEEP_MODES
+            - k: period for 'every', sample size for 'reservoir'
+            - seed: reservoir seed; stores given the same seed keep the same
+                    episodes
+        '''
+
+        if keep not in KEEP_MODES:
+            raise ValueError("keep must be one of {}".format(KEEP_MODES))
+
+        self.keep = keep
+        self.k = max(1, int(k))
+        self.hours = hours
+        self.count = 0      # episodes added so far
+
+        if keep == 'all':
+            capacity = episodes
+        elif keep == 'first_last':
+            capacity = 1
+        elif keep == 'every':
+            capacity = -(-episodes // self.k)
+        else:
+            capacity = 1 + min(self.k, max(0, episodes - 1))
+
+        # kept rows, plus the latest row (the last episode once training ends)
+        self.data = np.zeros((max(1, capacity), hours), dtype = dtype)
+        self.episodes = np.full(max(1, capacity), -1, dtype = np.int64)
+        self.latest = np.zeros(hours, dtype = dtype)
+
+        # own generator for the reservoir so the training random stream is
+        # the same whatever is kept
+        if keep == 'reservoir':
+            self.rng = np.random.default_rng(seed)
+
+
+    def __len__(self):
+
+        return len(self.kept()[0])
+
+
+    def _slot(self, episode):
+
+        # row of self.data the episode goes to, or None if it is not kept
+        if self.keep == 'all':
+            return episode if episode < len(self.data) else None
+        if self.keep == 'first_last' or episode == 0:
+            return 0 if episode == 0 else None
+        if self.keep == 'every':
+            return episode // self.k if episode % self.k == 0 else None
+
+        # reservoir sampling (algorithm R) over episodes 1, 2, ...
+        if episode <= self.k:
+            return episode
+        j = self.rng.integers(episode)
+        return j + 1 if j < self.k else None
+
+
+    def add(self, row):
+
+        '''
+        Input:
+            - row: hourly values of the next episode (shorter rows are
+                   padded with their last value)
+        '''
+
+        row = np.asarray(row)
+        n = min(len(row), self.hours)
+        self.latest[:n] = row[:n]
+        if 0 < n < self.hours:
+            self.latest[n:] = row[n - 1]
+
+        slot = self._slot(self.count)
+        if slot is not None:
+            self.data[slot] = self.latest
+            self.episodes[slot] = self.count
+        self.count += 1
+
+
+    def kept(self):
+
+        '''
+        Output:
+            - episodes: sorted indices of the kept episodes
+            - rows: (len(episodes), hours) array of their hourly values
+        '''
+
+        order = np.argsort(self.episodes)
+        order = order[self.episodes[order] >= 0]
+        episodes = self.episodes[order]
+        rows = self.data[order]
+
+        if self.count > 0 and (len(episodes) == 0 or episodes[-1] != self.count - 1):
+            episodes = np.append(episodes, self.count - 1)
+            rows = np.concatenate([rows, self.latest[None, :]])
+
+        return episodes, rows
+
+
+    def get_state(self):
+
+        state = {"data": self.data.copy(), "episodes": self.episodes.copy(),
+                 "latest": self.latest.copy(), "count": np.array(self.count)}
+        if self.keep == 'reservoir':
+            state["rng"] = json_array(self.rng.bit_generator.state)
+
+        return state
+
+
+    def set_state(self, state):
+
+        self.data[:] = state["data"]
+        self.episodes[:] = state["episodes"]
+        self.latest[:] = state["latest"]
+        self.count = int(state["count"])
+        if self.keep == 'reservoir':
+            self.rng.bit_generator.state = from_json_array(state["rng"])
+
+
+    def first(self):
+
+        return self.data[0] if self.episodes[0] == 0 else None
+
+
+    def last(self):
+
+        return self.latest if self.count > 0 else None
+
+
+    def save(self, fname):
+
+        # <fname>.npy holds the rows, <fname>_episodes.npy their episode indices
+        episodes, rows = self.kept()
+        np.save(fname + ".npy", rows)
+        np.save(fname + "_episodes.npy", episodes)
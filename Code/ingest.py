@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for ingesting CitiBike trip data into per-station hourly flows:
+    1) fetch_trip_file: download a trip file once to a local path
+    2) read_trip_chunks: read a trip file in chunks with only the needed
+                         columns and explicit dtypes, renamed to one
+                         canonical schema (trip_header) whatever the year:
+                         lowercase 2013-2020 headers ("starttime", "start
+                         station id"), capitalized ones ("Start Time",
+                         "Start Station ID") and the 2021+ schema
+                         ("started_at", "start_station_id", "start_lat")
+    3) chunk_flows: departures/arrivals per station, day and hour of a chunk
+                    with a single groupby
+    4) iter_trip_chunks / flow_accumulator: stream any number of trip files
+                    (e.g. monthly_trip_files) chunk by chunk into running
+                    per-station hourly totals with bounded memory
+    5) load_station_flows: dense (station, day, hour) departure/arrival/net
+                           arrays, cached on disk by the hash of the source
+                           files so later runs need no network and no parsing;
+                           the hashes themselves are kept per (path, size,
+                           modification time), so a cache hit reads no trips
+
+"""
+
+import urllib.request
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+TRIP_URL = "https://s3.amazonaws.com/tripdata/201709-citibike-tripdata.csv.zip"
+TRIP_FILE = "./data/201709-citibike-tripdata.csv.zip"
+CACHE_DIR = "./data/cache"
+
+# canonical trip columns; station IDs are read as text because the 2021+
+# schema uses IDs such as "5905.14" (see station_ids)
+TRIP_COLUMNS = {"starttime": "str",
+                "stoptime": "str",
+                "start station id": "str",
+                "start station name": "str",
+                "start station latitude": "float64",
+                "start station longitude": "float64",
+                "end station id": "str",
+                "end station name": "str",
+                "end station latitude": "float64",
+                "end station longitude": "float64"}
+
+# other header names, once lower-cased with "_" read as a space
+TRIP_ALIASES = {"start time": "starttime",
+                "started at": "starttime",
+                "stop time": "stoptime",
+                "ended at": "stoptime",
+                "start lat": "start station latitude",
+                "start lng": "start station longitude",
+                "end lat": "end station latitude",
+                "end lng": "end station longitude"}
+
+# bump when the cached arrays change (v2: station IDs are strings)
+CACHE_VERSION = "v2"
+
+
+def fetch_trip_file(trip_file = TRIP_FILE, url = TRIP_URL):
+
+    # download the trip file only if there is no local copy yet
+    if not os.path.exists(trip_file):
+        print("Downloading {} ...".format(url))
+        os.makedirs(os.path.dirname(trip_file) or ".", exist_ok = True)
+        urllib.request.urlretrieve(url, trip_file + ".part")
+        os.replace(trip_file + ".part", trip_file)
+
+    return trip_file
+
+
+def file_hash(fname, block_size = 1 << 20):
+
+    # sha1 of the file content, used as the cache key
+    sha = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def cached_file_hash(fname, cache_dir = CACHE_DIR):
+
+    '''
+    This function returns file_hash(fname), hashing the file only if its
+    size or modification time changed since the hash was stored in
+    <cache_dir>/file_hashes.json.
+    '''
+
+    index_file = os.path.join(cache_dir, "file_hashes.json")
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+
+    path = os.path.abspath(fname)
+    stat = os.stat(fname)
+    entry = index.get(path)
+    if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha1"]
+
+    index[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": file_hash(fname)}
+    os.makedirs(cache_dir, exist_ok = True)
+    with open(index_file + ".tmp", 'w') as f:
+        json.dump(index, f)
+    os.replace(index_file + ".tmp", index_file)
+
+    return index[path]["sha1"]
+
+
+def trip_header(trip_file):
+
+    '''
+    Output:
+        - {column of the file: canonical name in TRIP_COLUMNS}
+    Raises a ValueError naming the missing columns if the file has a schema
+    this module does not know.
+    '''
+
+    names = {}
+    for column in pd.read_csv(trip_file, nrows = 0).columns:
+        key = " ".join(str(column).strip().lower().replace("_", " ").split())
+        canonical = TRIP_ALIASES.get(key, key)
+        if canonical in TRIP_COLUMNS and canonical not in names.values():
+            names[column] = canonical
+
+    missing = [column for column in TRIP_COLUMNS if column not in names.values()]
+    if len(missing) > 0:
+        raise ValueError("{}: unsupported trip file schema, no column for {}".format(trip_file, missing))
+
+    return names
+
+
+def read_trip_chunks(trip_file, chunksize = 500000):
+
+    # iterate over a trip file without loading all trips in memory; every
+    # chunk has the TRIP_COLUMNS names
+    names = trip_header(trip_file)
+    dtype = {column: TRIP_COLUMNS[name] for column, name in names.items()}
+    for chunk in pd.read_csv(trip_file, usecols = list(names), dtype = dtype, chunksize = chunksize):
+        yield chunk.rename(columns = names)
+
+
+def trip_times(times):
+
+    # ISO timestamps (2013-2014, 2017+, with or without fractions of a second)
+    # or US dates ("9/1/2015 00:00:00", "1/1/2015 0:01") as in 2014-2016
+    values = times.dropna()
+    if len(values) == 0:
+        return pd.to_datetime(times, format = "ISO8601")
+
+    first = str(values.iloc[0])
+    if "/" not in first:
+        return pd.to_datetime(times, format = "ISO8601")
+    if first.count(":") == 2:
+        return pd.to_datetime(times, format = "%m/%d/%Y %H:%M:%S")
+    return pd.to_datetime(times, format = "%m/%d/%Y %H:%M")
+
+
+def station_ids(values):
+
+    # "497" and "497.0" -> "497"; IDs that are not whole numbers (2021+,
+    # e.g. "5905.14" or "JC013") are kept as they are; missing IDs stay NA
+    ids = pd.Series(values).astype("string").str.strip()
+    numbers = pd.to_numeric(ids, errors = "coerce")
+    whole = (numbers.notna() & (numbers == numbers.round())).to_numpy(dtype = bool)
+    ids[whole] = numbers[whole].astype(np.int64).astype("string")
+
+    return ids
+
+
+def chunk_flows(chunk):
+
+    '''
+    This function counts departures and arrivals of one chunk of trips.
+    Input:
+        - chunk: a DataFrame of trips with the TRIP_COLUMNS columns
+    Output:
+        - flows: a DataFrame indexed by (id, date, hour) with dep/arv counts
+        - stations: a DataFrame of id, name, lat, lon seen in the chunk
+    '''
+
+    start = trip_times(chunk["starttime"])
+    stop = trip_times(chunk["stoptime"])
+
+    # one row per event: departures at the start station, arrivals at the end
+    events = pd.DataFrame({
+        "id": np.concatenate([station_ids(chunk["start station id"]).to_numpy(dtype = object),
+                              station_ids(chunk["end station id"]).to_numpy(dtype = object)]),
+        "date": np.concatenate([start.dt.normalize().values, stop.dt.normalize().values]),
+        "hour": np.concatenate([start.dt.hour.values, stop.dt.hour.values]).astype(np.int8),
+        "dep": np.repeat(np.array([1, 0], dtype = np.int32), len(chunk)),
+        "arv": np.repeat(np.array([0, 1], dtype = np.int32), len(chunk))})
+    events = events.dropna(subset = ["id"])
+
+    flows = events.groupby(["id", "date", "hour"])[["dep", "arv"]].sum()
+
+    stations = []
+    for side in ["start", "end"]:
+        columns = [side + " station id", side + " station name",
+                   side + " station latitude", side + " station longitude"]
+        side_stations = chunk[columns].copy()
+        side_stations.columns = ["id", "name", "lat", "lon"]
+        side_stations["id"] = station_ids(side_stations["id"]).to_numpy(dtype = object)
+        stations.append(side_stations.dropna(subset = ["id"]).drop_duplicates("id"))
+    stations = pd.concat(stations).drop_duplicates("id")
+
+    return flows, stations
+
+
+def monthly_trip_files(start, end, data_dir = "./data", name = "%Y%m-citibike-tripdata.csv.zip"):
+
+    # local paths (downloaded on first use) of the monthly trip files that
+    # cover the calendar range [start, end]; name is the strftime pattern of
+    # the archive in the bucket, which is not the same for every year (e.g.
+    # "%Y%m-citibike-tripdata.zip" or "JC-%Y%m-citibike-tripdata.csv.zip"
+    # for Jersey City). Every archive must hold a single CSV file in one of
+    # the schemas read_trip_chunks knows.
+    months = pd.period_range(pd.Timestamp(start), pd.Timestamp(end), freq = "M")
+    trip_files = []
+
+    for month in months:
+        fname = month.strftime(name)
+        trip_files.append(fetch_trip_file(os.path.join(data_dir, fname),
+                                          "https://s3.amazonaws.com/tripdata/" + fname))
+
+    return trip_files
+
+
+def iter_trip_chunks(trip_files, chunksize = 500000):
+
+    # generator over the chunks of several trip files, one file at a time
+    for trip_file in trip_files:
+        print("Ingesting {} ...".format(trip_file))
+        for chunk in read_trip_chunks(trip_file, chunksize):
+            yield chunk
+
+
+class flow_accumulator():
+
+    '''
+    Running per-station hourly departure/arrival counts. Memory depends on
+    the number of stations and days only, never on the number of trips:
+        1) add_chunk: count one chunk of trips into the running totals
+        2) result: dense (station, day, hour) arrays of the totals so far
+    '''
+
+    def __init__(self, start = None, end = None):
+
+        # optional calendar range [start, end]; trips outside are ignored
+        self.start = None if start is None else np.datetime64(pd.Timestamp(start).date(), "D")
+        self.end = None if end is None else np.datetime64(pd.Timestamp(end).date(), "D")
+
+        self.rows = {}          # station id -> row in dep/arv
+        self.stations = {}      # station id -> (name, lat, lon)
+        self.first_day = None   # calendar day of column 0 in dep/arv
+        self.num_days = 0       # number of days seen from first_day on
+        self.dep = np.zeros((0, 0, 24), dtype = np.int32)
+        self.arv = np.zeros((0, 0, 24), dtype = np.int32)
+
+
+    def _reserve(self, num_stations, first_day, last_day):
+
+        # grow dep/arv (doubling) so that the stations and days fit
+        if self.first_day is None:
+            self.first_day = first_day
+        low = min(self.first_day, first_day)
+        high = max(self.first_day + self.num_days - 1, last_day)
+        shift = (self.first_day - low).astype(np.int64)
+        num_days = (high - low).astype(np.int64) + 1
+        cap_stations, cap_days, _ = self.dep.shape
+
+        if shift > 0 or num_stations > cap_stations or num_days > cap_days:
+            new_stations = max(num_stations, 2*cap_stations) if num_stations > cap_stations else cap_stations
+            new_days = max(num_days, 2*cap_days) if num_days > cap_days else cap_days
+            for name in ["dep", "arv"]:
+                new = np.zeros((new_stations, new_days, 24), dtype = np.int32)
+                new[:cap_stations, shift:shift + self.num_days] = getattr(self, name)[:, :self.num_days]
+                setattr(self, name, new)
+
+        self.first_day = low
+        self.num_days = num_days
+
+
+    def add_chunk(self, chunk):
+
+        flows, stations = chunk_flows(chunk)
+        self.add(flows, stations)
+
+
+    def add(self, flows, stations):
+
+        # flows: (id, date, hour) -> dep/arv counts, as from chunk_flows
+        dates = flows.index.get_level_values("date").values.astype("datetime64[D]")
+        keep = np.ones(len(flows), dtype = bool)
+        if self.start is not None:
+            keep &= dates >= self.start
+        if self.end is not None:
+            keep &= dates <= self.end
+        if not keep.any():
+            return
+        flows = flows[keep]
+        dates = dates[keep]
+
+        for ID, name, lat, lon in stations.itertuples(index = False):
+            if ID not in self.stations:
+                self.stations[ID] = (name, lat, lon)
+        ids = flows.index.get_level_values("id").values
+        for ID in np.unique(ids):
+            if ID not in self.rows:
+                self.rows[ID] = len(self.rows)
+                if ID not in self.stations:
+                    self.stations[ID] = ("", np.nan, np.nan)
+
+        self._reserve(len(self.rows), dates.min(), dates.max())
+
+        station_idx = np.array([self.rows[ID] for ID in ids])
+        day_idx = (dates - self.first_day).astype(np.int64)
+        hour_idx = flows.index.get_level_values("hour").values.astype(np.int64)
+
+        # (id, date, hour) keys are unique within flows
+        self.dep[station_idx, day_idx, hour_idx] += flows["dep"].values.astype(np.int32)
+        self.arv[station_idx, day_idx, hour_idx] += flows["arv"].values.astype(np.int32)
+
+
+    def result(self):
+
+        '''
+        Output:
+            - a dict with ids (strings, see station_ids), names, lat, lon 
+              (one per station, sorted by id), days (one per calendar day) and dep, arv, net arrays of 
+              shape (station, day, 24)
+        '''
+
+        ids = np.array(sorted(self.rows), dtype = str)
+        rows = np.array([self.rows[ID] for ID in ids], dtype = np.int64)
+
+        first_day = self.first_day if self.start is None or self.first_day is None else self.start
+        if self.first_day is None:
+            last_day = self.end
+        else:
+            last_day = self.first_day + self.num_days - 1 if self.end is None else self.end
+        if first_day is None:
+            days = np.array([], dtype = "datetime64[D]")
+        else:
+            days = np.arange(first_day, last_day + 1, dtype = "datetime64[D]")
+
+        dep = np.zeros((len(ids), len(days), 24), dtype = np.int32)
+        arv = np.zeros((len(ids), len(days), 24), dtype = np.int32)
+        if len(ids) > 0:
+            # align the accumulated days with the requested calendar range
+            lo = (first_day - self.first_day).astype(np.int64)
+            src = np.arange(len(days)) + lo
+            valid = (src >= 0) & (src < self.num_days)
+            dep[:, valid] = self.dep[rows][:, src[valid]]
+            arv[:, valid] = self.arv[rows][:, src[valid]]
+
+        return {"ids": ids,
+                "names": np.array([self.stations[ID][0] for ID in ids], dtype = str),
+                "lat": np.array([self.stations[ID][1] for ID in ids], dtype = np.float64),
+                "lon": np.array([self.stations[ID][2] for ID in ids], dtype = np.float64),
+                "days": days,
+                "dep": dep,
+                "arv": arv,
+                "net": arv - dep}
+
+
+def load_station_flows(trip_files = TRIP_FILE, cache_dir = CACHE_DIR, chunksize = 500000,
+                       start = None, end = None):
+
+    '''
+    This function returns the per-station hourly flows of one or more trip
+    files (e.g. from monthly_trip_files), optionally limited to the calendar
+    range [start, end]. Trips are streamed chunk by chunk into a 
+    flow_accumulator. The result is cached as .npz keyed by the file hashes 
+    and the range, so only the first run reads the trips (later runs only
+    stat them, see cached_file_hash).
+    '''
+
+    if isinstance(trip_files, str):
+        trip_files = [fetch_trip_file(trip_files)]
+
+    hashes = [cached_file_hash(trip_file, cache_dir) for trip_file in trip_files]
+    key = hashlib.sha1("|".join(hashes + [str(start), str(end)]).encode()).hexdigest()
+    cache_file = os.path.join(cache_dir, "flows_" + CACHE_VERSION + "_" + key + ".npz")
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            return {key: cached[key] for key in cached.files}
+
+    accumulator = flow_accumulator(start, end)
+    for chunk in iter_trip_chunks(trip_files, chunksize):
+        accumulator.add_chunk(chunk)
+    result = accumulator.result()
+
+    os.makedirs(cache_dir, exist_ok = True)
+    tmp_file = cache_file + ".tmp.npz"
+    np.savez_compressed(tmp_file, **result)
+    os.replace(tmp_file, cache_file)
+
+    return result
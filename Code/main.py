@@ -4,41 +4,157 @@
 
 This is the main workflow of the RL program.
 
+Without arguments the parameters are asked for interactively. With arguments
+the run is fully scripted, e.g.:
+    python main.py --data linear --brain q --episodes 1000 2000 --profile sample
+    python main.py --data random --brain all --ids 497 515 --workers 8 \
+                   --output-dir ./performance_log
+
 """
 
-from training import trainer
-import helper
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import argparse
+import sys
+import os
+
+
+def run_trainer(job):
+
+    # Train and log one brain on one station (in a worker process when
+    # several stations/brains are run)
+    from training import trainer
+
+    episode_list, data, ID, brain, model_based, station_history, workers, output_dir, profile, \
+        trainer_options = job
+
+    session = trainer(station_history, output_dir = output_dir, **trainer_options)
+    session.start(episode_list, data, logging = True, env_debug = False,
+                  rl_debug = False, brain = brain, ID = ID,
+                  model_based = model_based, workers = workers, profile = profile)
+
+
+def parse_args(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Train bike rebalancing operators.")
+    parser.add_argument("--data", default = "linear", choices = ["linear", "random", "actual"],
+                        help = "bike stock simulation")
+    parser.add_argument("--brain", default = "q", choices = ["q", "dqn", "plan", "all"],
+                        help = "agent type (plan: dynamic-programming reference)")
+    parser.add_argument("--model-based", action = "store_true",
+                        help = "use the expected balance forecast (q and plan brains)")
+    parser.add_argument("--ids", nargs = "+", type = int, default = [497],
+                        help = "station IDs from EXPECTED_BALANCES.json")
+    parser.add_argument("--episodes", nargs = "+", type = int, default = [1000, 2000],
+                        help = "episodes of each training session")
+    parser.add_argument("--workers", type = int, default = os.cpu_count() or 1,
+                        help = "number of worker processes")
+    parser.add_argument("--output-dir", default = "./performance_log",
+                        help = "folder for the performance logs")
+    parser.add_argument("--profile", default = None, choices = ["cprofile", "sample"],
+                        help = "profile each training session (report saved with the logs)")
+    parser.add_argument("--verbose", type = int, default = 1, choices = [0, 1, 2],
+                        help = "episode lines on the console: 0 none, 1 sampled, 2 all")
+    parser.add_argument("--print-every", type = int, default = 100,
+                        help = "print every n-th episode when --verbose is 1")
+    parser.add_argument("--log-every", type = int, default = 1,
+                        help = "write every n-th episode to the episode log (0 = no log file)")
+    parser.add_argument("--keep-history", default = "all",
+                        choices = ["all", "first_last", "every", "reservoir"],
+                        help = "episodes whose hourly actions/stocks are kept")
+    parser.add_argument("--keep-k", type = int, default = 100,
+                        help = "period of --keep-history every, sample size of reservoir")
+    parser.add_argument("--early-stop", action = "store_true",
+                        help = "stop a session once rewards, success and Q values plateau")
+    parser.add_argument("--stop-window", type = int, default = 100,
+                        help = "episodes per convergence window")
+    parser.add_argument("--stop-patience", type = int, default = 3,
+                        help = "stable windows in a row before stopping")
+    parser.add_argument("--no-charts", action = "store_true",
+                        help = "write only the numeric result files (large sweeps)")
+    parser.add_argument("--report-workers", type = int, default = 1,
+                        help = "number of processes rendering the charts")
+    parser.add_argument("--warm-start", default = None, choices = ["session", "station", "both"],
+                        help = "start sessions from the previous session and/or the most similar station")
+    parser.add_argument("--warm-dir", default = None,
+                        help = "directory of <ID>.npz policies for --warm-start station (sweep.py --policy-dir)")
+    parser.add_argument("--batch-size", type = int, default = 32,
+                        help = "DQN training batch size")
+    parser.add_argument("--memory-size", type = int, default = 100,
+                        help = "DQN replay buffer capacity")
+    parser.add_argument("--prioritized", action = "store_true",
+                        help = "sample DQN replay in proportion to TD error (see replay_buffer.py)")
+    parser.add_argument("--checkpoint-every", type = int, default = 0,
+                        help = "save the training state every n episodes (0 = never)")
+    parser.add_argument("--checkpoint-dir", default = None,
+                        help = "checkpoint directory (default <output-dir>/checkpoints)")
+    parser.add_argument("--resume", action = "store_true",
+                        help = "continue each session from its checkpoint")
+
+    return parser.parse_args(argv)
+
+
+def run(episode_list, data, IDs, brain, model_based, station_histories, workers, output_dir,
+        profile = None, trainer_options = None):
+    #trainer_options: keyword arguments of trainer() (verbose, print_every,
+    #                 log_every, keep_history, keep_k, charts, report_workers,
+    #                 early_stop, warm_start, warm_dir, checkpoint_every,
+    #                 checkpoint_dir, resume, dqn_options)
+
+    # one job per (station, brain); 'all' runs QLN, FCT and DQN side by side,
+    # with the DP optimum as reference
+    if brain == 'all':
+        settings = [('q', False), ('q', True), ('dqn', False), ('plan', False)]
+    else:
+        settings = [(brain, model_based if brain != 'dqn' else False)]
+
+    jobs = [(episode_list, data, ID, job_brain, job_model_based, station_histories.get(ID),
+             max(1, workers // (len(IDs) * len(settings))), output_dir, profile,
+             trainer_options or {})
+            for ID in IDs for job_brain, job_model_based in settings]
+
+    if len(jobs) == 1:
+        run_trainer(jobs[0])
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers = min(len(jobs), max(1, workers)),
+                                 mp_context = context) as pool:
+            list(pool.map(run_trainer, jobs))
+
 
 if __name__ == "__main__":
 
-    # Get Initial Parameters    
-    episode_list, data, ID, brain, model_based, station_history = helper.user_input()
+    if len(sys.argv) > 1:
+
+        # Scripted run
+        args = parse_args()
 
+        if args.data == 'actual':
+            # pandas (through helper and ingest) is only loaded for real data
+            import helper
+            station_histories = helper.citi_station_histories(args.ids)
+        else:
+            station_histories = {}
 
-    # Set Up a Training Environment
+        run(args.episodes, args.data, args.ids, args.brain, args.model_based,
+            station_histories, args.workers, args.output_dir, args.profile,
+            {"verbose": args.verbose, "print_every": args.print_every,
+             "log_every": args.log_every, "keep_history": args.keep_history,
+             "keep_k": args.keep_k, "charts": not args.no_charts,
+             "report_workers": args.report_workers,
+             "early_stop": {"window": args.stop_window, "patience": args.stop_patience}
+                           if args.early_stop else None,
+             "warm_start": args.warm_start, "warm_dir": args.warm_dir,
+             "checkpoint_every": args.checkpoint_every, "checkpoint_dir": args.checkpoint_dir,
+             "resume": args.resume,
+             "dqn_options": {"batch_size": args.batch_size, "memory_size": args.memory_size,
+                             "prioritized": args.prioritized}})
 
-    if brain != 'all':
-        trainer = trainer(station_history)
-        trainer.start(episode_list, data, logging  = 
-                      True, env_debug = False, rl_debug = False,
-                      brain=brain, ID = ID, model_based = model_based)
     else:
-        
-        # update the subsequent trainer init workflow
-        # Run a end to end test
-        
-        trainer_QLN = trainer(station_history)
-        trainer_FCT = trainer(station_history)
-        trainer_DQN = trainer(station_history)
-        
-        trainer_QLN.start(episode_list, data, logging  = 
-                      True, env_debug = False, rl_debug = False,
-                      brain='q', ID = ID, model_based = False)
-        
-        trainer_FCT.start(episode_list, data, logging  = 
-                      True, env_debug = False, rl_debug = False,
-                      brain='q', ID = ID, model_based = True)
-        
-        trainer_DQN.start(episode_list, data, logging  = 
-                      True, env_debug = False, rl_debug = False,
-                      brain='dqn', ID = ID, model_based = False)
+
+        # Get Initial Parameters
+        import helper
+        episode_list, data, ID, brain, model_based, station_history = helper.user_input()
+
+        run(episode_list, data, [ID], brain, model_based, {ID: station_history},
+            os.cpu_count() or 1, "./performance_log")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for creating a dynamic-programming planner, the 'plan' brain
+of the trainer. With the actions [-10, -3, -1, 0] and the reward table of
+reward.py, the optimal rebalancing schedule of a known (or forecast) 24-hour
+stock can be computed exactly by backward induction over
+    (hour, bikes moved so far, previous reward)
+The previous reward is part of the state because the environment carries it
+over when no bikes are moved. Methods:
+    - plan(): value iteration over the whole day for a base stock series
+    - schedule(): the optimal actions, stocks and rewards from the start
+    - choose_action() / learn() / get_hourly_*() / reset_hourly_history():
+      the agent interface used by trainer.train_operator
+    - get_state() / set_state(): the planned stock series (set_state plans
+      it again), for checkpointing
+
+Planned on the simulated stock itself, the result is the ground-truth best
+return the learned agents can be benchmarked against; planned on the
+EXPECTED_BALANCES forecast (forecast_stock) it is a model-based operator.
+
+"""
+
+import numpy as np
+from reward import reward_engine
+from history import hourly_buffer
+
+
+def forecast_stock(first_stock, expected):
+
+    '''
+    Input:
+        - first_stock: stock at hour 0
+        - expected: expected stock of the next hour, for each hour (e.g.
+                    EXPECTED_BALANCES.json[ID])
+    Output:
+        - int array: forecast stock of every hour of the day
+    '''
+
+    return np.round(np.append(first_stock, np.asarray(expected, dtype = np.float64))).astype(np.int64)
+
+
+class planner():
+
+    def __init__(self, actions = [-10, -3, -1, 0], fuel_cost = 0.5, debug = False):
+
+        print("Created a Planner ...")
+        self.actions = list(actions)
+        self.rewards = reward_engine(self.actions, fuel_cost)
+        self.debug = debug
+        self.epsilon = 1    # always follows the plan
+        self.no_move = self.actions.index(0)
+
+        # ties are broken towards the smallest move
+        self.tie_order = np.argsort(np.abs(self.actions), kind = "stable")
+
+        # every reward an hour before the last can pass on, plus 0 at the start
+        self.prev_values = np.unique(np.append(self.rewards.table[0].ravel(), 0.0))
+
+        self.base = None
+        self.hourly_action_history = hourly_buffer()
+        self.hourly_stock_history = hourly_buffer()
+        self.reset_hourly_history()
+
+
+    def plan(self, base):
+
+        '''
+        This function computes the optimal value and action of every
+        (hour, offset, previous reward) state for the given stock series.
+        Input:
+            - base: hourly stock without rebalancing (the last entry is the
+                    final hour)
+        Output:
+            - the optimal return of the day (all hours, final reward included)
+        '''
+
+        self.base = np.asarray(base, dtype = np.int64)
+        H = len(self.base)
+        low = min(0, min(self.actions))*(H - 1)
+        high = max(0, max(self.actions))*(H - 1)
+        self.offsets = np.arange(low, high + 1)
+        n_o, n_p, n_a = len(self.offsets), len(self.prev_values), len(self.actions)
+        prev = self.prev_values[None, :]
+
+        self.values = np.zeros((H, n_o, n_p))
+        self.policy = np.full((H, n_o, n_p), self.no_move, dtype = np.int8)
+
+        # last hour: only the final stock counts
+        stocks = (self.base[H - 1] + self.offsets)[:, None]
+        self.values[H - 1] = self.rewards.evaluate(True, stocks, self.no_move, prev)
+
+        rows = np.arange(n_o)
+        for h in range(H - 2, -1, -1):
+            stocks = (self.base[h] + self.offsets)[:, None]
+            Q = np.empty((n_o, n_p, n_a))
+            for i, action in enumerate(self.actions):
+                r = self.rewards.evaluate(False, stocks, i, prev)
+                following = rows + action
+                valid = (following >= 0) & (following < n_o)
+                future = self.values[h + 1][np.clip(following, 0, n_o - 1)[:, None],
+                                            np.searchsorted(self.prev_values, r)]
+                Q[..., i] = np.where(valid[:, None], r + future, -np.inf)
+
+            best = self.tie_order[np.argmax(Q[..., self.tie_order], axis = 2)]
+            self.policy[h] = best
+            self.values[h] = np.take_along_axis(Q, best[..., None], axis = 2)[..., 0]
+
+        if self.debug == True:
+            print("Planned {} hours over {} offsets: optimal return {}".format(H, n_o, self.optimal_return()))
+
+        return self.optimal_return()
+
+
+    def state(self, offset, prev):
+
+        # indices of (offset, previous reward) in the planning arrays
+        o = int(offset) - self.offsets[0]
+        p = int(np.searchsorted(self.prev_values, prev))
+
+        return min(max(o, 0), len(self.offsets) - 1), min(p, len(self.prev_values) - 1)
+
+
+    def optimal_return(self):
+
+        o, p = self.state(0, 0.0)
+
+        return float(self.values[0, o, p])
+
+
+    def schedule(self):
+
+        '''
+        Output:
+            - actions: bikes moved at every hour of the optimal plan
+            - stocks: stock at every hour after rebalancing
+            - rewards: reward of every hour (the last is the final reward)
+        '''
+
+        actions, stocks, rewards = [], [], []
+        offset, prev = 0, 0.0
+        H = len(self.base)
+
+        for h in range(H):
+            o, p = self.state(offset, prev)
+            index = int(self.policy[h, o, p])
+            stock = int(self.base[h] + offset)
+            prev = self.rewards.lookup(h == H - 1, stock, index, prev)
+            actions.append(self.actions[index] if h < H - 1 else 0)
+            stocks.append(stock)
+            rewards.append(prev)
+            offset += actions[-1]
+
+        return actions, stocks, rewards
+
+
+    def choose_action(self, s, ex):
+
+        '''
+        This function follows the plan one hour at a time. The planner keeps
+        track of its own moves and rewards (the plan is open-loop), so s and
+        ex are only recorded.
+        Input:
+            - s: current bike stock
+            - ex: expected bike stock (unused)
+        Output:
+            - action: number of bikes to move
+        '''
+
+        H = len(self.base)
+        if self.hour >= H:
+            self.reset_hourly_history()
+
+        o, p = self.state(self.offset, self.prev)
+        index = int(self.policy[self.hour, o, p])
+        action = self.actions[index]
+        self.prev = self.rewards.lookup(self.hour == H - 1, self.base[self.hour] + self.offset,
+                                        index, self.prev)
+        if self.hour < H - 1:
+            self.offset += action
+        self.hour += 1
+
+        if self.debug == True:
+            print("Planned Move: {}".format(action))
+
+        self.hourly_action_history.append(action)
+        self.hourly_stock_history.append(s)
+
+        return action
+
+
+    def learn(self, s, a, r, s_, ex, g):
+
+        # the plan is exact; nothing to learn
+        return
+
+
+    def parameter_snapshot(self):
+
+        return None
+
+
+    def parameter_change(self, snapshot):
+
+        return 0.0
+
+
+    def get_state(self):
+
+        return {"base": self.base.copy()}
+
+
+    def set_state(self, state):
+
+        self.plan(state["base"])
+
+
+    def get_hourly_actions(self):
+
+        return self.hourly_action_history.get()
+
+
+    def get_hourly_stocks(self):
+
+        return self.hourly_stock_history.get()
+
+
+    def reset_hourly_history(self):
+
+        # also restarts the plan at hour 0 for the next episode
+        self.hourly_action_history.reset()
+        self.hourly_stock_history.reset()
+        self.hour = 0
+        self.offset = 0
+        self.prev = 0.0
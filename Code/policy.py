@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for exporting trained agents as compact inference-only
+policies and serving them with NumPy alone (no pandas, no TensorFlow):
+    1) tabular_policy_arrays: dense int8 action lookup over the stock range
+                              of a q_table, plus its float64 Q values (only
+                              used to warm start, so they are kept exact)
+    2) dqn_policy_arrays: frozen float32 weights of a DeepQNetwork eval_net
+    3) save_policy / load_policy: .npz persistence
+    4) tabular_policy / dqn_policy: act() for one stock and act_batch() for
+                                    arrays of stocks, returning bikes to move
+    5) load_tabular_arrays / load_dqn_arrays: copy exported arrays back into
+       a q_table or DeepQNetwork (warm start)
+    6) similar_station_policy: exported arrays of the station whose expected
+       balances are closest to a given station's
+
+"""
+
+import numpy as np
+import os
+
+ACTIONS = [-10, -3, -1, 0]
+
+
+def tabular_policy_arrays(q_table, model_based = False):
+
+    '''
+    This function freezes an array-backed q_table into a greedy lookup.
+    Stocks the agent never visited, or whose Q values are all equal (nothing
+    learned, e.g. still all zero), map to no move (action 0) rather than to 
+    the first action.
+    '''
+
+    actions = np.array(q_table.actions, dtype = np.int8)
+    values = q_table.values.astype(np.float64)
+    policy = np.argmax(values, axis = 1).astype(np.int8)
+    unlearned = np.all(values == values[:, :1], axis = 1)
+    policy[~q_table.seen | unlearned] = q_table.actions.index(0)
+
+    return {"kind": np.array("tabular"),
+            "actions": actions,
+            "low": np.array(q_table.low, dtype = np.int64),
+            "policy": policy,
+            "q_values": values,
+            "seen": q_table.seen.copy(),
+            "model_based": np.array(bool(model_based))}
+
+
+def dqn_policy_arrays(dqn_net):
+
+    # frozen weights of the evaluation network, layer by layer
+    arrays = {"kind": np.array("dqn"),
+              "actions": np.array(ACTIONS[:dqn_net.n_actions], dtype = np.int8)}
+    layer_types = []
+
+    for layer in dqn_net.eval_net.layers:
+        i = len(layer_types)
+        name = layer.__class__.__name__
+        if name == "Dense":
+            layer_types.append("relu" if layer.activation.__name__ == "relu" else "linear")
+            arrays["kernel_" + str(i)] = np.asarray(layer.kernel.numpy(), dtype = np.float32)
+            arrays["bias_" + str(i)] = np.asarray(layer.bias.numpy(), dtype = np.float32)
+        elif name == "BatchNormalization":
+            # fold the inference-mode normalization into a scale and shift
+            scale = layer.gamma.numpy() / np.sqrt(layer.moving_variance.numpy() + layer.epsilon)
+            layer_types.append("affine")
+            arrays["scale_" + str(i)] = scale.astype(np.float32)
+            arrays["shift_" + str(i)] = (layer.beta.numpy() - layer.moving_mean.numpy()*scale).astype(np.float32)
+        # Dropout is the identity at inference time
+
+    arrays["layers"] = np.array(layer_types)
+
+    return arrays
+
+
+def load_tabular_arrays(q_table, arrays):
+
+    # Q values of an exported tabular policy back into a q_table
+    values = np.asarray(arrays["q_values"], dtype = np.float64)
+    if "seen" in arrays:
+        seen = np.asarray(arrays["seen"], dtype = bool)
+    else:
+        seen = np.any(values != 0, axis = 1)
+
+    q_table.low = int(arrays["low"])
+    q_table.values = values.copy()
+    q_table.seen = seen.copy()
+    q_table.states = [q_table.low + int(row) for row in np.flatnonzero(seen)]
+
+
+def load_dqn_arrays(dqn_net, arrays):
+
+    '''
+    This function copies exported weights into the eval and target networks
+    of a DeepQNetwork with the same architecture. A folded BatchNormalization
+    is restored as gamma = scale, beta = shift with zero mean and unit
+    variance, which gives the same outputs at inference time.
+    '''
+
+    for net in [dqn_net.eval_net, dqn_net.target_net]:
+        i = 0
+        for layer in net.layers:
+            name = layer.__class__.__name__
+            if name == "Dense":
+                layer.kernel.assign(arrays["kernel_" + str(i)])
+                layer.bias.assign(arrays["bias_" + str(i)])
+                i += 1
+            elif name == "BatchNormalization":
+                layer.gamma.assign(arrays["scale_" + str(i)])
+                layer.beta.assign(arrays["shift_" + str(i)])
+                layer.moving_mean.assign(np.zeros_like(arrays["shift_" + str(i)]))
+                layer.moving_variance.assign(np.full_like(arrays["scale_" + str(i)], 1 - layer.epsilon))
+                i += 1
+
+
+def similar_station_policy(policy_dir, ID, expected_balance, kind):
+
+    '''
+    Input:
+        - policy_dir: directory of <ID>.npz policies (e.g. sweep.py --policy-dir)
+        - ID: station to find a neighbour for (its own policy is skipped)
+        - expected_balance: EXPECTED_BALANCES.json as a dict
+        - kind: 'tabular' or 'dqn'
+    Output:
+        - (station ID, arrays) of the policy of that kind whose station has the
+          nearest expected balances (Euclidean distance), or (None, None)
+    '''
+
+    ID = str(ID)
+    target = np.asarray(expected_balance[ID], dtype = np.float64)
+    candidates = []
+    for fname in os.listdir(policy_dir):
+        station, ext = os.path.splitext(fname)
+        if ext == ".npz" and station != ID and station in expected_balance:
+            distance = np.linalg.norm(np.asarray(expected_balance[station], dtype = np.float64) - target)
+            candidates.append((distance, station))
+
+    for _, station in sorted(candidates):
+        with np.load(os.path.join(policy_dir, station + ".npz")) as data:
+            if str(data["kind"]) == kind:
+                return station, {key: data[key] for key in data.files}
+
+    return None, None
+
+
+def save_policy(arrays, fname):
+
+    np.savez(fname, **arrays)
+
+
+def load_policy(fname):
+
+    with np.load(fname) as data:
+        arrays = {key: data[key] for key in data.files}
+
+    if str(arrays["kind"]) == "tabular":
+        return tabular_policy(arrays)
+    return dqn_policy(arrays)
+
+
+class tabular_policy():
+
+    def __init__(self, arrays):
+
+        self.actions = arrays["actions"]
+        self.low = int(arrays["low"])
+        self.policy = arrays["policy"]
+        self.model_based = bool(arrays["model_based"])
+        self.no_move = int(np.flatnonzero(self.actions == 0)[0])
+
+
+    def act_batch(self, stocks, expected = None):
+
+        '''
+        Input:
+            - stocks: array of current bike stocks
+            - expected: array of expected stocks (model-based policies only)
+        Output:
+            - array of bikes to move, same shape as stocks
+        '''
+
+        states = np.asarray(stocks)
+        if self.model_based and expected is not None:
+            states = np.round(0.5*states + 0.5*np.asarray(expected, dtype = np.float64))
+        rows = states.astype(np.int64) - self.low
+
+        inside = (rows >= 0) & (rows < len(self.policy))
+        index = np.where(inside, self.policy[np.clip(rows, 0, len(self.policy) - 1)], self.no_move)
+
+        return self.actions[index]
+
+
+    def act(self, stock, expected = None):
+
+        state = stock
+        if self.model_based and expected is not None:
+            state = int(round(0.5*stock + 0.5*expected))
+        row = int(state) - self.low
+
+        if 0 <= row < len(self.policy):
+            return int(self.actions[self.policy[row]])
+        return int(self.actions[self.no_move])
+
+
+class dqn_policy():
+
+    def __init__(self, arrays):
+
+        self.actions = arrays["actions"]
+        self.layers = []
+
+        for i, layer_type in enumerate(arrays["layers"]):
+            if layer_type == "affine":
+                self.layers.append((str(layer_type), arrays["scale_" + str(i)], arrays["shift_" + str(i)]))
+            else:
+                self.layers.append((str(layer_type), arrays["kernel_" + str(i)], arrays["bias_" + str(i)]))
+
+        self.n_features = self.layers[0][1].shape[0]
+
+
+    def q_values(self, observations):
+
+        # pure NumPy forward pass of the frozen eval_net
+        x = np.asarray(observations, dtype = np.float32).reshape(-1, self.n_features)
+
+        for layer_type, a, b in self.layers:
+            if layer_type == "affine":
+                x = x*a + b
+            else:
+                x = x @ a + b
+                if layer_type == "relu":
+                    x = np.maximum(x, 0)
+
+        return x
+
+
+    def act_batch(self, stocks, expected = None):
+
+        stocks = np.asarray(stocks)
+        shape = stocks.shape if self.n_features == 1 else stocks.shape[:-1]
+
+        return self.actions[np.argmax(self.q_values(stocks), axis = 1)].reshape(shape)
+
+
+    def act(self, stock, expected = None):
+
+        return int(self.actions[np.argmax(self.q_values(stock)[0])])
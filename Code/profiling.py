@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for finding where the training time goes:
+    1) phase_timer: low-overhead wall-clock totals per phase of the
+                    training loop (action selection, env step, Q update,
+                    DQN learn, history logging, ...); get_state() /
+                    set_state() carry them across a resumed session
+    2) session_profiler: optional per-session cProfile ('cprofile') or
+                         stack sampling ('sample') of the training loop
+    3) write_timing_report: text summary saved next to the session results
+
+"""
+
+from checkpoint import json_array, from_json_array
+from collections import Counter
+import threading
+import cProfile
+import pstats
+import time
+import sys
+import io
+
+PROFILE_MODES = [None, 'cprofile', 'sample']
+
+
+class phase_timer():
+
+    def __init__(self):
+
+        self.totals = {}
+        self.counts = {}
+        self.start_time = time.perf_counter()
+
+
+    def lap(self, phase, since):
+
+        '''
+        Charge the time since `since` to `phase` and return the current time,
+        so consecutive phases chain as t = timer.lap("phase", t).
+        '''
+
+        now = time.perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0.0) + now - since
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+        return now
+
+
+    def get_state(self):
+
+        return {"totals": json_array(self.totals), "counts": json_array(self.counts),
+                "wall_seconds": time.perf_counter() - self.start_time}
+
+
+    def set_state(self, state):
+
+        # wall time keeps counting from where the checkpoint left off
+        self.totals = from_json_array(state["totals"])
+        self.counts = from_json_array(state["counts"])
+        self.start_time = time.perf_counter() - float(state["wall_seconds"])
+
+
+    def summary(self):
+
+        # {phase: {seconds, calls, mean_us, share}} plus the total wall time
+        wall = time.perf_counter() - self.start_time
+        phases = {}
+        for phase in sorted(self.totals, key = self.totals.get, reverse = True):
+            seconds = self.totals[phase]
+            phases[phase] = {"seconds": seconds,
+                             "calls": self.counts[phase],
+                             "mean_us": seconds*1e6 / self.counts[phase],
+                             "share": seconds / wall if wall > 0 else 0.0}
+
+        return {"wall_seconds": wall, "phases": phases}
+
+
+class session_profiler():
+
+    def __init__(self, mode = None, interval = 0.005, limit = 30):
+
+        '''
+        Input:
+            - mode: None (off), 'cprofile' (deterministic, every call) or
+                    'sample' (the stack of the training thread is sampled
+                    every `interval` seconds; far lower overhead)
+            - limit: number of functions kept in the report
+        '''
+
+        if mode not in PROFILE_MODES:
+            raise ValueError("profile must be one of {}".format(PROFILE_MODES))
+
+        self.mode = mode
+        self.interval = interval
+        self.limit = limit
+        self.profiler = None
+        self.samples = Counter()
+        self.n_samples = 0
+        self.running = False
+        self.thread = None
+
+
+    def __enter__(self):
+
+        if self.mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.mode == 'sample':
+            self.running = True
+            self.thread = threading.Thread(target = self._sample, args = (threading.get_ident(),),
+                                           daemon = True)
+            self.thread.start()
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        if self.mode == 'cprofile':
+            self.profiler.disable()
+        elif self.mode == 'sample':
+            self.running = False
+            self.thread.join()
+
+        return False
+
+
+    def _sample(self, thread_id):
+
+        # count every function on the training thread's stack once per sample
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(thread_id)
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                seen.add("{}:{}({})".format(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.samples.update(seen)
+            self.n_samples += 1
+
+
+    def report(self):
+
+        # plain text, so it can be returned from worker processes
+        if self.mode == 'cprofile':
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream = stream)
+            stats.sort_stats("cumulative").print_stats(self.limit)
+            return stream.getvalue()
+
+        if self.mode == 'sample':
+            lines = ["{} samples every {} s (share of samples with the function on the stack)"
+                     .format(self.n_samples, self.interval)]
+            for function, count in self.samples.most_common(self.limit):
+                lines.append("{:6.1%}  {}".format(count / max(1, self.n_samples), function))
+            return "\n".join(lines) + "\n"
+
+        return None
+
+
+def write_timing_report(fname, timings, episodes, method = None):
+
+    '''
+    Input:
+        - timings: one dict per session with the phase_timer summary under
+                   "phases" and an optional profiler report under "profile"
+        - episodes: episodes of each session
+    '''
+
+    with open(fname, 'w') as f:
+
+        if method is not None:
+            f.write("Method: {}\n".format(method))
+
+        for session, timing in enumerate(timings):
+            f.write("\nSession {} | Episodes: {} | Wall Time: {:.3f}s\n".format(session,
+                    episodes[session], timing["wall_seconds"]))
+            f.write("{:<20}{:>12}{:>12}{:>12}{:>8}\n".format("phase", "seconds", "calls",
+                    "mean_us", "share"))
+            for phase, stats in timing["phases"].items():
+                f.write("{:<20}{:>12.4f}{:>12}{:>12.2f}{:>7.1f}%\n".format(phase,
+                        stats["seconds"], stats["calls"], stats["mean_us"], stats["share"]*100))
+
+            if timing.get("profile"):
+                f.write("\n--- Profile ({}) ---\n".format(timing["profile_mode"]))
+                f.write(timing["profile"])
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for creating an array-backed Q table class. States are integer
+bike stocks stored in a dense NumPy array at row (stock - low), so reads and
+updates are O(1). The array grows in chunks in both directions when a new
+stock value is seen. It has the following methods:
+    1) check_state_exist: add a state (zero row) if it was never seen
+    2) get / update / max: O(1) access to Q(s, a)
+    3) argmax: greedy action with random tie-breaking
+    4) to_frame / to_csv: the visited states as a pandas DataFrame, or
+       straight to a CSV file in the same layout without pandas (logging)
+    5) snapshot / delta_norm: how much the values changed since a snapshot
+    6) get_state / set_state: arrays for checkpointing (see checkpoint.py)
+
+"""
+
+import numpy as np
+
+class q_table():
+
+    def __init__(self, actions, chunk = 64):
+
+        self.actions = list(actions)
+        self.n_actions = len(self.actions)
+        self.action_index = {a: i for i, a in enumerate(self.actions)}
+        self.chunk = chunk
+
+        self.low = 0        # state stored at row 0
+        self.values = np.zeros((0, self.n_actions))
+        self.seen = np.zeros(0, dtype = bool)
+        self.states = []    # visited states in insertion order
+
+
+    def _grow(self, state):
+
+        # reallocate so that state fits, doubling capacity to amortize copies
+        size = len(self.values)
+        if size == 0:
+            new_low = state - self.chunk//2
+            new_size = self.chunk
+        else:
+            low = min(self.low, state - self.chunk//2)
+            high = max(self.low + size, state + self.chunk//2 + 1)
+            new_size = max(2*size, high - low)
+            # put the spare capacity on the side the table is growing towards
+            new_low = high - new_size if state < self.low else low
+
+        values = np.zeros((new_size, self.n_actions))
+        seen = np.zeros(new_size, dtype = bool)
+        shift = self.low - new_low
+        values[shift:shift + size] = self.values
+        seen[shift:shift + size] = self.seen
+
+        self.low, self.values, self.seen = new_low, values, seen
+
+
+    def index(self, state):
+
+        # row of a state, adding it to the table if it does not exist
+        state = int(state)
+        row = state - self.low
+        if row < 0 or row >= len(self.values):
+            self._grow(state)
+            row = state - self.low
+        if not self.seen[row]:
+            self.seen[row] = True
+            self.states.append(state)
+        return row
+
+
+    def check_state_exist(self, state):
+
+        self.index(state)
+
+
+    def __contains__(self, state):
+
+        row = int(state) - self.low
+        return 0 <= row < len(self.values) and bool(self.seen[row])
+
+
+    def __len__(self):
+
+        return len(self.states)
+
+
+    def row(self, state):
+
+        row = self.index(state)
+        return self.values[row]
+
+
+    def get(self, state, action):
+
+        row = self.index(state)
+        return self.values[row, self.action_index[action]]
+
+
+    def update(self, state, action, delta):
+
+        row = self.index(state)
+        self.values[row, self.action_index[action]] += delta
+
+
+    def max(self, state):
+
+        row = self.index(state)
+        return self.values[row].max()
+
+
+    def argmax(self, state):
+
+        # pick among the best actions uniformly, like idxmax over a shuffled row
+        row = self.index(state)
+        values = self.values[row]
+        best = np.flatnonzero(values == values.max())
+        if len(best) == 1:
+            return self.actions[best[0]]
+        return self.actions[best[np.random.randint(len(best))]]
+
+
+    def snapshot(self):
+
+        return self.low, self.values.copy()
+
+
+    def delta_norm(self, snapshot):
+
+        # norm of the change since snapshot, rows aligned by state (the table
+        # may have grown in between; new states count from zero)
+        low, values = snapshot
+        change = self.values.copy()
+        shift = low - self.low
+        change[shift:shift + len(values)] -= values
+
+        return float(np.linalg.norm(change))
+
+
+    def get_state(self):
+
+        return {"low": np.array(self.low), "values": self.values.copy(), "seen": self.seen.copy(),
+                "states": np.array(self.states, dtype = np.int64)}
+
+
+    def set_state(self, state):
+
+        self.low = int(state["low"])
+        self.values = np.array(state["values"], dtype = np.float64)
+        self.seen = np.array(state["seen"], dtype = bool)
+        self.states = [int(s) for s in state["states"]]
+
+
+    def to_frame(self):
+
+        import pandas as pd
+
+        rows = [state - self.low for state in self.states]
+        return pd.DataFrame(self.values[rows], index = self.states, columns = self.actions)
+
+
+    def to_csv(self, fname):
+
+        # same file as to_frame().to_csv(fname)
+        with open(fname, 'w') as f:
+            f.write("," + ",".join(str(a) for a in self.actions) + "\n")
+            for state in self.states:
+                values = self.values[state - self.low].tolist()
+                f.write(str(state) + "," + ",".join(str(v) for v in values) + "\n")
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for creating the replay memory used by the Deep Q Network:
+    1) replay_buffer: preallocated typed columns (state, action, reward,
+       next state, done) in a ring buffer with single and bulk inserts and
+       uniform sampling
+    2) sum_tree: binary tree of priorities with O(log n) updates and
+       vectorized prefix-sum lookups
+    3) prioritized_replay_buffer: replay_buffer sampled in proportion to
+       priority^alpha, with importance-sampling weights
+
+All of them can be checkpointed with get_state / set_state.
+
+Sampling cost depends on the batch size (and log of the capacity for the
+prioritized buffer), never on how full or how large the buffer is.
+
+"""
+
+import numpy as np
+
+class replay_buffer():
+
+    def __init__(self, capacity, n_features):
+
+        self.capacity = capacity
+        self.n_features = n_features
+        self.counter = 0    # number of transitions ever stored
+
+        self.states = np.zeros((capacity, n_features), dtype = np.float32)
+        self.actions = np.zeros(capacity, dtype = np.int32)
+        self.rewards = np.zeros(capacity, dtype = np.float32)
+        self.next_states = np.zeros((capacity, n_features), dtype = np.float32)
+        self.dones = np.zeros(capacity, dtype = np.float32)
+
+
+    def __len__(self):
+
+        return min(self.counter, self.capacity)
+
+
+    def store(self, s, a, r, s_, done = False):
+
+        index = self.counter % self.capacity
+        self.states[index] = s
+        self.actions[index] = a
+        self.rewards[index] = r
+        self.next_states[index] = s_
+        self.dones[index] = done
+        self.counter += 1
+
+        return index
+
+
+    def store_batch(self, s, a, r, s_, done):
+
+        '''
+        Bulk insert, e.g. one step of a batch_env.
+        Input:
+            - s, s_: arrays of shape (batch, n_features), or (batch,) when
+                     n_features is 1
+            - a, r, done: arrays of shape (batch,)
+        Output:
+            - index: the buffer rows that were written
+        '''
+
+        a = np.asarray(a).reshape(-1)
+        index = np.arange(self.counter, self.counter + len(a)) % self.capacity
+        self.states[index] = np.asarray(s).reshape(-1, self.n_features)
+        self.actions[index] = a
+        self.rewards[index] = np.asarray(r).reshape(-1)
+        self.next_states[index] = np.asarray(s_).reshape(-1, self.n_features)
+        self.dones[index] = np.asarray(done).reshape(-1)
+        self.counter += len(a)
+
+        return index
+
+
+    def batch(self, index):
+
+        return (self.states[index], self.actions[index], self.rewards[index],
+                self.next_states[index], self.dones[index])
+
+
+    def sample(self, batch_size):
+
+        '''
+        Output:
+            - index: sampled buffer rows
+            - (states, actions, rewards, next_states, dones)
+            - weights: importance-sampling weights (all 1 for uniform sampling)
+        '''
+
+        index = np.random.randint(0, len(self), size = batch_size)
+
+        return index, self.batch(index), np.ones(batch_size, dtype = np.float32)
+
+
+    def update_priorities(self, index, td_errors):
+
+        # uniform sampling has no priorities
+        return
+
+
+    def get_state(self):
+
+        return {"counter": np.array(self.counter), "states": self.states.copy(),
+                "actions": self.actions.copy(), "rewards": self.rewards.copy(),
+                "next_states": self.next_states.copy(), "dones": self.dones.copy()}
+
+
+    def set_state(self, state):
+
+        self.counter = int(state["counter"])
+        self.states[:] = state["states"]
+        self.actions[:] = state["actions"]
+        self.rewards[:] = state["rewards"]
+        self.next_states[:] = state["next_states"]
+        self.dones[:] = state["dones"]
+
+
+class sum_tree():
+
+    def __init__(self, capacity):
+
+        # leaves live at [size, size + capacity) of a complete binary tree
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.depth = int(np.log2(self.size))
+        self.tree = np.zeros(2*self.size)
+
+
+    def total(self):
+
+        return self.tree[1]
+
+
+    def update(self, index, priority):
+
+        # set leaf priorities and refresh their ancestors, one level at a time
+        nodes = np.asarray(index, dtype = np.int64).reshape(-1) + self.size
+        self.tree[nodes] = np.asarray(priority, dtype = np.float64).reshape(-1)
+
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2*nodes] + self.tree[2*nodes + 1]
+
+
+    def find(self, values):
+
+        # leaf index whose prefix-sum interval contains each value
+        values = np.array(values, dtype = np.float64).reshape(-1)
+        nodes = np.ones(len(values), dtype = np.int64)
+
+        for _ in range(self.depth):
+            left = 2*nodes
+            go_right = values > self.tree[left]
+            values = np.where(go_right, values - self.tree[left], values)
+            nodes = np.where(go_right, left + 1, left)
+
+        return nodes - self.size
+
+
+class prioritized_replay_buffer(replay_buffer):
+
+    def __init__(self, capacity, n_features, alpha = 0.6, beta = 0.4, epsilon = 1e-3):
+
+        replay_buffer.__init__(self, capacity, n_features)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.tree = sum_tree(capacity)
+
+
+    def store(self, s, a, r, s_, done = False):
+
+        # new transitions get the highest priority so they are replayed soon
+        index = replay_buffer.store(self, s, a, r, s_, done)
+        self.tree.update(index, self.max_priority)
+
+        return index
+
+
+    def store_batch(self, s, a, r, s_, done):
+
+        index = replay_buffer.store_batch(self, s, a, r, s_, done)
+        self.tree.update(index, np.full(len(index), self.max_priority))
+
+        return index
+
+
+    def sample(self, batch_size):
+
+        # one sample from each of batch_size equal slices of the priority mass
+        bounds = np.linspace(0, self.tree.total(), batch_size + 1)
+        values = np.random.uniform(bounds[:-1], bounds[1:])
+        index = np.minimum(self.tree.find(values), len(self) - 1)
+
+        probs = self.tree.tree[index + self.tree.size] / self.tree.total()
+        weights = (len(self) * np.maximum(probs, 1e-12)) ** (-self.beta)
+        weights = (weights / weights.max()).astype(np.float32)
+
+        return index, self.batch(index), weights
+
+
+    def update_priorities(self, index, td_errors):
+
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(index, priorities)
+
+
+    def get_state(self):
+
+        state = replay_buffer.get_state(self)
+        state["tree"] = self.tree.tree.copy()
+        state["max_priority"] = np.array(self.max_priority)
+
+        return state
+
+
+    def set_state(self, state):
+
+        replay_buffer.set_state(self, state)
+        self.tree.tree[:] = state["tree"]
+        self.max_priority = float(state["max_priority"])
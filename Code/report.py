@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for rendering the charts of a training session headlessly:
+    - success_rate_chart()
+    - reward_history_chart()
+    - reward_averages_chart()
+    - action_history_chart()
+    - stock_history_chart()
+    - render_charts(): runs a list of (chart function, arguments) jobs in
+                       this process or across a pool of worker processes
+
+Every chart draws on its own Agg figure (no pyplot state, no GUI backend)
+and releases it as soon as the file is written, so memory does not grow
+with the number of sessions.
+
+"""
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+
+
+def new_figure(figsize = None):
+
+    fig = Figure(figsize = figsize)
+    FigureCanvasAgg(fig)
+
+    return fig, fig.add_subplot(1, 1, 1)
+
+
+def save_figure(fig, fname):
+
+    fig.savefig(fname)
+    fig.clear()
+
+
+def success_rate_chart(fname, episodes, successful_stocking, title):
+
+    fig, ax = new_figure()
+    ax.plot(episodes, successful_stocking)
+    ax.set_xlabel("Episodes")
+    ax.set_ylabel("% Success Rate")
+    ax.set_title(title)
+    save_figure(fig, fname)
+
+
+def reward_history_chart(fname, rewards, session, title):
+
+    fig, ax = new_figure(figsize = (10, 8))
+    ax.plot(np.arange(len(rewards)), rewards, label = "Session " + str(session))
+    ax.legend()
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Reward")
+    ax.set_title(title)
+    save_figure(fig, fname)
+
+
+def reward_averages_chart(fname, rewards):
+
+    # inter-quartile range and mean episode reward of each session by its size
+    fig, ax = new_figure(figsize = (10, 8))
+    lengths = [len(r) for r in rewards]
+    means = [np.mean(r) for r in rewards]
+    # sessions may have stopped early, so lengths need not increase
+    if len(rewards) > 1 and lengths[1] != lengths[0]:
+        increment = abs(lengths[1]-lengths[0])/20
+    else:
+        increment = lengths[0]/20
+
+    for reward_list in rewards:
+        Q3 = np.percentile(reward_list, 75)
+        Q1 = np.percentile(reward_list, 25)
+        M = np.mean(reward_list)
+        location = len(reward_list)
+        ax.plot([location-increment, location+increment], [Q1, Q1], 'k-')
+        ax.plot([location-increment, location+increment], [Q3, Q3], 'k-')
+        ax.plot([location, location], [Q1, Q3], 'k-')
+        ax.scatter(location, M, s=100, color='dodgerblue')
+
+    ax.set_xlabel('Number of Episodes in Session')
+    ax.set_ylabel('Average Reward per Episode')
+    ax.set_title('Average Reward vs. Session Size', size=20)
+    ax.set_xticks(lengths)
+
+    ax.plot(lengths, means, linestyle='--')
+    save_figure(fig, fname)
+
+
+def action_history_chart(fname, session, kept_eps, actions):
+
+    fig, ax = new_figure(figsize = (10, 8))
+    title = "Session " + str(session) + " - Hourly Action of Eps " + str(kept_eps[0]) + " and Eps " + str(kept_eps[-1])
+
+    x_axis = np.arange(actions.shape[1])
+    ax.plot(x_axis, actions[0], label = "Eps " + str(kept_eps[0]))
+    ax.plot(x_axis, actions[-1], label = "Eps " + str(kept_eps[-1]))
+
+    ax.legend()
+    ax.set_xlabel("Hours")
+    ax.set_ylabel("Number of Bikes Moved")
+    ax.set_title(title)
+    save_figure(fig, fname)
+
+
+def stock_history_chart(fname, title, sim_stock, kept_eps, stocks):
+
+    fig, ax = new_figure(figsize = (10, 8))
+
+    x_axis = np.arange(stocks.shape[1])
+    ax.plot(x_axis, sim_stock, label = "Original without Balancing")
+    ax.plot(x_axis, stocks[0], label = "Balanced Bike Stock - Eps " + str(kept_eps[0]))
+    ax.plot(x_axis, stocks[-1], label = "Balanced Bike Stock - Eps " + str(kept_eps[-1]))
+
+    ax.axhline(y = 50, c = "r", ls = "-", label = "Upper Stock Limit")
+    ax.axhline(y = 35, c = "m", ls = "--", label = "Upper Target Limit")
+    ax.axhline(y = 15, c = "m", ls = "--", label = "Lower Target Limit")
+    ax.axhline(y = 0, c = "r", ls = "-", label = "Lower Stock Limit")
+
+    ax.legend()
+    ax.set_xlabel("Hours")
+    ax.set_ylabel("Number of Bike Stock")
+    ax.set_title(title)
+    save_figure(fig, fname)
+
+
+def render_chart(job):
+
+    chart, args = job
+    chart(*args)
+
+
+def render_charts(jobs, workers = 1):
+
+    '''
+    Input:
+        - jobs: list of (chart function, argument tuple)
+        - workers: number of processes (1 = render in this process)
+    '''
+
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            render_chart(job)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers = min(workers, len(jobs)),
+                             mp_context = context) as pool:
+        list(pool.map(render_chart, jobs))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script is for computing the rebalancing reward from a precomputed table
+shared by env.ping, env.ping_dqn and batch_env.step:
+    - reward_engine: compiles the thresholds, fuel cost and terminal rewards
+      into a lookup over (last hour?, stock, action). Stocks below 0 or
+      above max_threshold all earn the same reward, so the stock axis only
+      spans [-1, max_threshold + 1] and any stock is clipped into it.
+
+When no bikes are moved and the stock is within the targets (before the
+last hour), the previous reward is kept; the `carry` table marks those
+entries.
+
+"""
+
+import numpy as np
+
+
+class reward_engine():
+
+    def __init__(self, actions, fuel_cost, min_target = 15, max_target = 35, max_threshold = 50,
+                 target_penalty = -20, threshold_penalty = -100, in_target_reward = 500,
+                 in_bounds_reward = 100, out_of_bounds_penalty = -200):
+
+        self.actions = list(actions)
+        self.fuel_cost = fuel_cost
+        self.low = -1
+        self.high = max_threshold + 1
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+
+        stock = np.arange(self.low, self.high + 1)[:, None]
+        move = np.array(self.actions)[None, :]
+        shape = (len(stock), len(self.actions))
+
+        # hours before the last: fuel cost of the move, overridden by penalties
+        reward = np.broadcast_to(-fuel_cost*np.abs(move), shape).astype(np.float64)
+        carry = np.broadcast_to(move == 0, shape).copy()
+        over = stock > max_target
+        under = stock < min_target
+        reward = np.where(over, np.where(stock > max_threshold, threshold_penalty, target_penalty), reward)
+        reward = np.where(under, np.where(stock < 0, threshold_penalty, target_penalty), reward)
+        carry &= ~(over | under)
+
+        # last hour: only the final stock counts
+        in_bounds = (stock <= max_threshold) & (stock > 0)
+        in_target = (stock <= max_target) & (stock >= min_target)
+        final = np.broadcast_to(np.where(in_bounds, np.where(in_target, in_target_reward,
+                                in_bounds_reward), out_of_bounds_penalty), shape)
+
+        self.table = np.stack([reward, final]).astype(np.float64)     # (2, stocks, actions)
+        self.carry = np.stack([carry, np.zeros(shape, dtype = bool)])
+
+        # [last hour][action] -> list over stocks, None where the reward
+        # carries over; plain lists are much faster than NumPy for one lookup
+        self.columns = [[[None if c else r for r, c in zip(self.table[t, :, i].tolist(),
+                                                            self.carry[t, :, i].tolist())]
+                         for i in range(len(self.actions))] for t in range(2)]
+        self.last_row = self.high - self.low
+
+
+    def lookup(self, terminal, stock, index, previous):
+
+        '''
+        Input:
+            - terminal: True at the last hour of the episode
+            - stock: bike stock at the current hour
+            - index: index of the action in self.actions
+            - previous: reward of the previous hour
+        Output:
+            - reward
+        '''
+
+        row = stock - self.low
+        if row < 0:
+            row = 0
+        elif row > self.last_row:
+            row = self.last_row
+
+        reward = self.columns[terminal][index][int(row)]
+        if reward is None:
+            return previous
+
+        return reward
+
+
+    def evaluate(self, terminal, stocks, indices, previous):
+
+        # vectorized lookup; all arguments broadcast against each other
+        rows = np.clip(stocks, self.low, self.high) - self.low
+        terminal = np.asarray(terminal, dtype = np.int64)
+
+        return np.where(self.carry[terminal, rows, indices], previous,
+                        self.table[terminal, rows, indices])
@@ -6,19 +6,25 @@ This script is for creating a RL agent class object. This object has the
 following method:
     
     1) choose_action: this choose an action based on Q(s,a) and greedy eps
+       (choose_actions does the same for a batch of DQN observations)
     2) learn: this updates the Q(s,a) table
     3) check_if_state_exist: this check if a state exist based on env feedback
+    4) warm_start: this initializes the Q table / DQN weights from an
+       exported policy (see policy.py)
+    5) get_state / set_state: everything the agent has learned, as arrays
+       for checkpointing (see checkpoint.py)
 
 """
 
 import numpy as np
-import pandas as pd
-from dqn import DeepQNetwork
+from history import hourly_buffer
+from q_table import q_table
+from checkpoint import nest, unnest
 
 class agent():
     
     
-    def __init__(self, epsilon, lr, gamma, current_stock, debug, expected_stock, model_based, dqn_flag = False, n_features = 1):
+    def __init__(self, epsilon, lr, gamma, current_stock, debug, expected_stock, model_based, dqn_flag = False, n_features = 1, batch_size = 32, memory_size = 100, prioritized = False):
         
         print("Created an Agent ...")
         self.actions = [-10, -3, -1, 0]
@@ -34,12 +40,19 @@ class agent():
         self.n_features = n_features
         
         # performance metric
-        self.q_table = pd.DataFrame(columns = self.actions, dtype = np.float64)
-        self.hourly_action_history = []
-        self.hourly_stock_history = []
+        self.q_table = q_table(self.actions)
+        self.hourly_action_history = hourly_buffer()
+        self.hourly_stock_history = hourly_buffer()
         
         # DQN Parameters
-        self.dqn_net = DeepQNetwork(len(self.actions), self.n_features, self.lr, 0.9)
+        # the network (and TensorFlow, imported by dqn) is only built for the
+        # DQN brain; tabular agents never pay for it
+        self.dqn_net = None
+        if self.dqn_flag:
+            from dqn import DeepQNetwork
+            self.dqn_net = DeepQNetwork(len(self.actions), self.n_features, self.lr, 0.9,
+                                        batch_size = batch_size, memory_size = memory_size,
+                                        prioritized = prioritized)
         
        
     def choose_action(self, s, ex):
@@ -72,18 +85,16 @@ class agent():
             except:
                 avg = s
             self.check_state_exist(avg)
-            valid_state_action = self.q_table.loc[avg, :]
+            state = avg
 
         elif self.model_based == False:
-            valid_state_action = self.q_table.loc[s, :]
+            state = s
         
         
         if self.dqn_flag:
             
-            observation = np.expand_dims(s, axis=0)
-            
             if np.random.uniform() < self.epsilon:
-                actions_value = self.dqn_net.eval_net(observation).numpy()
+                actions_value = self.dqn_net.predict(s)
                 action = np.argmax(actions_value)
             else:
                 action = np.random.randint(0, len(self.actions))
@@ -91,15 +102,9 @@ class agent():
         
             if np.random.uniform() < self.epsilon:
 
-                try:
-                    # find the action with the highest expected reward
-
-                    valid_state_action = valid_state_action.reindex(np.random.permutation(valid_state_action.index))
-                    action = valid_state_action.idxmax()
-
-                except:
-                    # if action list is null, default to 0
-                    action = 0
+                # find the action with the highest expected reward
+                # (ties are broken randomly)
+                action = self.q_table.argmax(state)
 
                 if self.debug == True:
                     print("Decided to Move: {}".format(action))
@@ -107,11 +112,7 @@ class agent():
             else:
 
                 # randomly choose an action
-                # re-pick if the action leads to negative stock
-                try:
-                    action = np.random.choice(valid_state_action.index)
-                except:
-                    action = 0
+                action = self.actions[np.random.randint(len(self.actions))]
 
                 if self.debug == True:
                     print("Randomly Move: {}".format(action))
@@ -123,6 +124,22 @@ class agent():
  
     
 
+    def choose_actions(self, s):
+        
+        '''
+        This function chooses DQN actions for many environments at once (e.g.
+        the stations/episodes of a batch_env) with a single forward pass. 
+        Hourly history is not recorded for batched calls.
+        Input:
+            - s: array of current bike stocks
+        Output:
+            - actions: array of action indices with the same shape as s
+        '''
+        
+        return self.dqn_net.choose_actions(s, self.epsilon)
+ 
+    
+
     def learn(self, s, a, r, s_, ex, g):
 
         
@@ -147,36 +164,30 @@ class agent():
         self.check_state_exist(s_)
 
         if self.model_based == False:
-            q_predict = self.q_table.loc[s, a]
+            state = s
         elif self.model_based == True:
-            avg = int(round(0.5*s + 0.5*ex))
-            self.check_state_exist(avg)
-            q_predict = self.q_table.loc[avg, a]
+            state = int(round(0.5*s + 0.5*ex))
+        q_predict = self.q_table.get(state, a)
         
 
         if g == False:
             
 
             # Updated Q Target Value if it is not end of day  
-            q_target = r + self.gamma * self.q_table.loc[s_, :].max()
+            q_target = r + self.gamma * self.q_table.max(s_)
         
         else:
             # Update Q Target Value as Immediate reward if end of day
             q_target = r
 
-        if self.model_based == False:
-            self.q_table.loc[s, a] += self.lr * (q_target - q_predict)
-        elif self.model_based == True:
-            self.q_table.loc[avg, a] += self.lr * (q_target - q_predict)
+        self.q_table.update(state, a, self.lr * (q_target - q_predict))
         
         return
 
     
     def check_state_exist(self, state):
         # If the state does not exist, add it to the Q-table
-        if state not in self.q_table.index:
-            new_row = pd.Series([0] * len(self.actions), index=self.q_table.columns, name=state)
-            self.q_table = pd.concat([self.q_table, new_row.to_frame().T])
+        self.q_table.check_state_exist(state)
     
 
     def find_valid_action(self, state_action):
@@ -205,24 +216,94 @@ class agent():
     
     def print_q_table(self):
         
-        print(self.q_table)
+        print(self.q_table.to_frame())
+
+
+    def warm_start(self, arrays):
+        
+        '''
+        Input:
+            - arrays: policy arrays exported from a trained agent of the same
+                      brain (tabular_policy_arrays / dqn_policy_arrays)
+        '''
+        
+        from policy import load_tabular_arrays, load_dqn_arrays
+        
+        kind = "dqn" if self.dqn_flag else "tabular"
+        if str(arrays["kind"]) != kind:
+            raise ValueError("cannot warm start a {} agent from a {} policy".format(kind, arrays["kind"]))
+        
+        if self.dqn_flag:
+            load_dqn_arrays(self.dqn_net, arrays)
+        else:
+            load_tabular_arrays(self.q_table, arrays)
+        
+        if self.debug == True:
+            print("Warm started the {} agent".format(kind))
+
+
+    def get_state(self):
+        
+        state = {"epsilon": np.array(self.epsilon)}
+        if self.dqn_flag:
+            state.update(nest("dqn", self.dqn_net.get_state()))
+        else:
+            state.update(nest("q_table", self.q_table.get_state()))
+        
+        return state
+    
+    
+    def set_state(self, state):
+        
+        self.epsilon = float(state["epsilon"])
+        if self.dqn_flag:
+            self.dqn_net.set_state(unnest("dqn", state))
+        else:
+            self.q_table.set_state(unnest("q_table", state))
+
+
+    def parameter_snapshot(self):
+        
+        # copy of what the agent has learned, for parameter_change()
+        if self.dqn_flag:
+            return [w.copy() for w in self.dqn_net.eval_net.get_weights()]
+        return self.q_table.snapshot()
+    
+    
+    def parameter_change(self, snapshot):
+        
+        '''
+        Output:
+            - norm of the change of the Q table (or DQN weights) since the
+              snapshot, relative to the norm of the current values
+        '''
+        
+        if self.dqn_flag:
+            weights = self.dqn_net.eval_net.get_weights()
+            change = np.sqrt(sum(np.sum((w - w0)**2) for w, w0 in zip(weights, snapshot)))
+            size = np.sqrt(sum(np.sum(w**2) for w in weights))
+        else:
+            change = self.q_table.delta_norm(snapshot)
+            size = np.linalg.norm(self.q_table.values)
+        
+        return float(change / max(size, 1e-12))
 
 
     def get_q_table(self):
         
-        return self.q_table
+        return self.q_table.to_frame()
 
     
     def get_hourly_actions(self):
         
-        return self.hourly_action_history
+        return self.hourly_action_history.get()
     
     def get_hourly_stocks(self):
         
-        return self.hourly_stock_history
+        return self.hourly_stock_history.get()
 
     
     def reset_hourly_history(self):
         
-        self.hourly_action_history = []
-        self.hourly_stock_history = []
+        self.hourly_action_history.reset()
+        self.hourly_stock_history.reset()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script serves rebalancing decisions from exported policies (see
+policy.py and sweep.py --policy-dir) over a local HTTP service. All station
+policies are loaded into memory once at start-up:
+    - GET  /decide?station=497&stock=20&expected=25
+          -> {"station": "497", "stock": 20, "move": -3}
+    - POST /decide  {"queries": [{"station": "497", "stock": 20, "expected": 25}, ...]}
+          -> {"moves": [-3, ...]}
+    - GET  /stats   -> request count and p50/p99 decision latency (microseconds)
+    - GET  /health
+
+Example:
+    python serve.py --policy-dir ./policies --port 8000
+    curl "http://127.0.0.1:8000/decide?station=497&stock=40"
+
+request_decision() and request_decisions() are minimal local clients.
+
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from urllib.request import urlopen, Request
+from collections import deque
+import threading
+import argparse
+import json
+import time
+import os
+import numpy as np
+from policy import load_policy
+
+
+class policy_store():
+
+    def __init__(self, policy_dir, IDs = None):
+
+        '''
+        Load every <ID>.npz policy in policy_dir (only the given IDs, e.g. the
+        keys of EXPECTED_BALANCES.json, if IDs is not None).
+        '''
+
+        self.policies = {}
+        for fname in sorted(os.listdir(policy_dir)):
+            ID, ext = os.path.splitext(fname)
+            if ext == ".npz" and (IDs is None or ID in IDs):
+                self.policies[ID] = load_policy(os.path.join(policy_dir, fname))
+
+        print("Loaded {} station policies".format(len(self.policies)))
+
+
+    def decide(self, station, stock, expected = None):
+
+        # number of bikes to move at a station given its stock (and forecast)
+        return self.policies[str(station)].act(stock, expected)
+
+
+    def decide_batch(self, queries):
+
+        # group the queries by station, and by whether they carry a forecast,
+        # so each policy runs one batched lookup per group and a query without
+        # expected does not drop it for the other queries of its station
+        moves = [0] * len(queries)
+        groups = {}
+        for i, query in enumerate(queries):
+            key = (str(query["station"]), query.get("expected") is not None)
+            groups.setdefault(key, []).append(i)
+
+        for (station, has_expected), rows in groups.items():
+            stocks = np.array([queries[i]["stock"] for i in rows])
+            expected = np.array([queries[i]["expected"] for i in rows]) if has_expected else None
+            for i, move in zip(rows, self.policies[station].act_batch(stocks, expected)):
+                moves[i] = int(move)
+
+        return moves
+
+
+class latency_log():
+
+    def __init__(self, size = 100000):
+
+        # most recent decision latencies in seconds
+        self.latencies = deque(maxlen = size)
+        self.count = 0
+        self.lock = threading.Lock()
+
+
+    def record(self, seconds):
+
+        with self.lock:
+            self.latencies.append(seconds)
+            self.count += 1
+
+
+    def summary(self):
+
+        with self.lock:
+            latencies = np.array(self.latencies)
+            count = self.count
+
+        if len(latencies) == 0:
+            return {"count": count, "p50_us": None, "p99_us": None}
+
+        return {"count": count,
+                "p50_us": round(float(np.percentile(latencies, 50))*1e6, 2),
+                "p99_us": round(float(np.percentile(latencies, 99))*1e6, 2)}
+
+
+def make_handler(store, latencies):
+
+    class decision_handler(BaseHTTPRequestHandler):
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+
+            if url.path == "/health":
+                self.send_json(200, {"status": "ok", "stations": len(store.policies)})
+            elif url.path == "/stats":
+                self.send_json(200, latencies.summary())
+            elif url.path == "/decide":
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                try:
+                    station = params["station"]
+                    stock = int(params["stock"])
+                    expected = float(params["expected"]) if "expected" in params else None
+                    start_time = time.perf_counter()
+                    move = store.decide(station, stock, expected)
+                    latencies.record(time.perf_counter() - start_time)
+                except (KeyError, ValueError) as ex:
+                    self.send_json(400, {"error": "bad query: {}".format(ex)})
+                    return
+                self.send_json(200, {"station": station, "stock": stock, "move": move})
+            else:
+                self.send_json(404, {"error": "unknown path"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/decide":
+                self.send_json(404, {"error": "unknown path"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                start_time = time.perf_counter()
+                moves = store.decide_batch(body["queries"])
+                latencies.record(time.perf_counter() - start_time)
+            except (KeyError, ValueError, TypeError) as ex:
+                self.send_json(400, {"error": "bad query: {}".format(ex)})
+                return
+            self.send_json(200, {"moves": moves})
+
+        def log_message(self, format, *args):
+            # keep the console quiet; latency is reported by /stats
+            return
+
+    return decision_handler
+
+
+def serve(policy_dir, host = "127.0.0.1", port = 8000, IDs = None):
+
+    store = policy_store(policy_dir, IDs)
+    server = ThreadingHTTPServer((host, port), make_handler(store, latency_log()))
+    print("Serving rebalancing decisions on http://{}:{}".format(*server.server_address))
+
+    return server
+
+
+def request_decision(url, station, stock, expected = None):
+
+    query = "{}/decide?station={}&stock={}".format(url, station, stock)
+    if expected is not None:
+        query += "&expected={}".format(expected)
+    with urlopen(query) as response:
+        return json.loads(response.read())["move"]
+
+
+def request_decisions(url, queries):
+
+    request = Request(url + "/decide", data = json.dumps({"queries": queries}).encode(),
+                      headers = {"Content-Type": "application/json"})
+    with urlopen(request) as response:
+        return json.loads(response.read())["moves"]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Serve rebalancing decisions.")
+    parser.add_argument("--policy-dir", default = "./policies")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8000)
+    args = parser.parse_args()
+
+    with open('EXPECTED_BALANCES.json') as json_data:
+        IDs = set(json.load(json_data).keys())
+
+    server = serve(args.policy_dir, args.host, args.port, IDs)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script runs a non-interactive sweep that trains and evaluates an agent
+for every station in EXPECTED_BALANCES.json (or a chosen subset):
+    - run_station(): train one station and evaluate its greedy policy
+    - completed_stations(): read the stations already in a results file
+    - sweep_seed(): the base seed of a sweep, kept next to its results file
+                    so a resumed sweep seeds its stations the same way
+    - sweep(): schedule the stations across worker processes and stream one
+               results row per station to a CSV file as they finish
+
+Example:
+    python sweep.py --data linear --brain q --episodes 1000 --workers 8
+    python sweep.py --ids 497 515 --resume
+    python sweep.py --episodes 5000 --early-stop
+    python sweep.py --policy-dir ./policies     (policies for serve.py)
+    python sweep.py --warm-dir ./policies       (start from similar stations)
+    python sweep.py --checkpoint-every 500 --resume
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import argparse
+import json
+import time
+import csv
+import os
+import numpy as np
+
+RESULT_COLUMNS = ["ID", "method", "data", "episodes", "episodes_run", "seed", "success_rate",
+                  "avg_reward", "eval_reward", "eval_final_stock", "optimal_reward",
+                  "optimal_final_stock", "seconds"]
+
+
+def run_station(job):
+
+    '''
+    This function trains an agent on one station and evaluates its greedy
+    policy. It runs in a worker process.
+    Input:
+        - job: (ID, data, brain, model_based, episodes, seed, station_history,
+                policy_dir, early_stop, warm_dir); the greedy policy is exported
+                to policy_dir/<ID>.npz unless policy_dir is None, training stops
+                once converged unless early_stop is None (see convergence.py)
+                and the agent starts from the policy of the most similar other
+                station in warm_dir unless warm_dir is None; trainer_options
+                are keyword arguments of the trainer (checkpoint_every,
+                checkpoint_dir, resume, dqn_options), and the station's
+                checkpoint is removed once it is done
+    Output:
+        - a dict with one value per RESULT_COLUMNS entry; optimal_* is the
+          dynamic-programming optimum on the same simulated stock and the
+          same reward table (fuel cost of ping or ping_dqn) and convention
+          as eval_reward, see planner.py
+    '''
+
+    # imported here so that the parent process never loads the training stack
+    from training import trainer
+    from planner import planner
+
+    ID, data, brain, model_based, episodes, seed, station_history, policy_dir, early_stop, \
+        warm_dir, trainer_options = job
+    start_time = time.time()
+    np.random.seed(seed)
+
+    session = trainer(station_history, early_stop = early_stop,
+                      warm_start = 'station' if warm_dir is not None else None, warm_dir = warm_dir,
+                      **trainer_options)
+    session.configure(data, False, False, False, brain, ID, model_based)
+    session.seed = seed
+    session.episodes = [episodes]
+    session.create_session()
+    initial = session.station_policy()
+    if initial is not None:
+        session.operator.warm_start(initial)
+
+    if brain == 'plan':
+        rewards, final_stocks = session.run_plan(0, 1)
+    else:
+        rewards, final_stocks = session.train_operator(0, 1, episodes, logging = False,
+                                                       brain = brain, model_based = model_based)
+    session.rewards.append(rewards)
+    session.avg_rewards.append(np.mean(rewards))
+    session.final_stocks.append(final_stocks)
+    success_rate = session.cal_performance()[0]
+
+    eval_reward, eval_final_stock = session.evaluate_operator()
+
+    # scored with the reward table the brain is trained and evaluated on
+    # (ping_dqn charges less fuel per bike than ping)
+    if brain == 'dqn':
+        fuel_cost = session.bike_station.ping_dqn_rewards.fuel_cost
+    else:
+        fuel_cost = session.bike_station.ping_rewards.fuel_cost
+    reference = planner(session.bike_station.actions, fuel_cost)
+    reference.plan(session.bike_station.bike_stock_sim)
+    _, optimal_stocks, optimal_rewards = reference.schedule()
+
+    if policy_dir is not None and brain != 'plan':
+        from policy import tabular_policy_arrays, dqn_policy_arrays, save_policy
+        if brain == 'q':
+            policy = tabular_policy_arrays(session.operator.q_table, model_based)
+        else:
+            policy = dqn_policy_arrays(session.operator.dqn_net)
+        save_policy(policy, os.path.join(policy_dir, str(ID) + ".npz"))
+
+    if session.checkpoint_every > 0 and os.path.exists(session.checkpoint_file(0)):
+        os.remove(session.checkpoint_file(0))
+
+    return {"ID": ID, "method": session.method, "data": data, "episodes": episodes,
+            "episodes_run": len(rewards),
+            "seed": seed, "success_rate": success_rate, "avg_reward": np.mean(rewards),
+            "eval_reward": eval_reward, "eval_final_stock": eval_final_stock,
+            "optimal_reward": sum(optimal_rewards[:-1]), "optimal_final_stock": optimal_stocks[-1],
+            "seconds": round(time.time() - start_time, 3)}
+
+
+def completed_stations(fname):
+
+    # station IDs that already have a row in the results file
+    if not os.path.exists(fname):
+        return set()
+
+    with open(fname, newline = '') as f:
+        return {row["ID"] for row in csv.DictReader(f)}
+
+
+def sweep_seed(fname, seed = None, resume = False):
+
+    '''
+    This function returns the base seed entropy of the sweep writing fname.
+    A new sweep draws it from seed (fresh entropy if seed is None) and saves 
+    it to <fname without .csv>_seed.json; a resumed sweep reads it back.
+    Raises a ValueError if a resumed sweep has no saved seed (results of an
+    older sweep) and no seed is given, or if seed differs from the saved one.
+    '''
+
+    seed_file = os.path.splitext(fname)[0] + "_seed.json"
+    entropy = np.random.SeedSequence(seed).entropy
+
+    if resume and os.path.exists(seed_file):
+        with open(seed_file) as f:
+            saved = json.load(f)["entropy"]
+        if seed is not None and saved != entropy:
+            raise ValueError("--seed {} does not match the seed of the sweep being resumed "
+                             "({}, saved in {})".format(seed, saved, seed_file))
+        return saved
+
+    if resume and seed is None and os.path.exists(fname):
+        raise ValueError("{} has no saved seed; resume it with the --seed of the "
+                         "original sweep".format(fname))
+
+    with open(seed_file, 'w') as f:
+        json.dump({"entropy": entropy}, f)
+
+    return entropy
+
+
+def sweep(IDs, data, brain, model_based, episodes, workers, fname, resume = False, seed = None,
+          policy_dir = None, early_stop = None, warm_dir = None, checkpoint_every = 0,
+          dqn_options = None):
+
+    '''
+    This function trains and evaluates every station in IDs across a pool of
+    worker processes. Each result is appended to fname as soon as its station
+    finishes, so an interrupted sweep can be resumed with resume = True.
+    A station that fails is reported and left out of fname (a resumed sweep
+    tries it again); the other stations are still recorded.
+    warm_dir should hold the policies of an earlier sweep: if it is also the
+    policy_dir, which neighbours are available depends on the finishing order.
+    With checkpoint_every > 0 each station also saves its training state to
+    <fname without .csv>_checkpoints, and a resumed sweep continues the
+    unfinished stations where they stopped.
+    '''
+
+    with open('EXPECTED_BALANCES.json') as json_data:
+        known = json.load(json_data)
+    unknown = [str(ID) for ID in IDs if str(ID) not in known]
+    if len(unknown) > 0:
+        print("Skipping stations not in EXPECTED_BALANCES.json: {}".format(unknown))
+
+    done = completed_stations(fname) if resume else set()
+    IDs = [str(ID) for ID in IDs if str(ID) not in done and str(ID) in known]
+    print("Sweeping {} stations ({} already done) ...".format(len(IDs), len(done)))
+
+    if data == 'actual':
+        import helper
+        station_histories = helper.citi_station_histories(IDs)
+        missing = [ID for ID in IDs if ID not in station_histories]
+        if len(missing) > 0:
+            print("No CitiBike history for stations: {}".format(missing))
+        IDs = [ID for ID in IDs if ID in station_histories]
+    else:
+        station_histories = {}
+
+    # one independent seed per station, reproducible from the base seed and
+    # the station ID so that a resumed sweep gives the same results
+    base_seed = sweep_seed(fname, seed, resume)
+    trainer_options = {"dqn_options": dqn_options}
+    if checkpoint_every > 0:
+        trainer_options.update({"checkpoint_every": checkpoint_every, "resume": resume,
+                                "checkpoint_dir": os.path.splitext(fname)[0] + "_checkpoints"})
+    jobs = [(ID, data, brain, model_based, episodes,
+             int(np.random.SeedSequence(base_seed, spawn_key = (int(ID),)).generate_state(1)[0]),
+             station_histories.get(ID), policy_dir, early_stop, warm_dir, trainer_options)
+            for ID in IDs]
+    if policy_dir is not None:
+        os.makedirs(policy_dir, exist_ok = True)
+
+    write_header = not (resume and os.path.exists(fname))
+
+    with open(fname, 'a' if resume else 'w', newline = '') as f:
+
+        writer = csv.DictWriter(f, fieldnames = RESULT_COLUMNS)
+        if write_header:
+            writer.writeheader()
+            f.flush()
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers = max(1, workers), mp_context = context) as pool:
+
+            futures = {pool.submit(run_station, job): job[0] for job in jobs}
+            failed = []
+
+            for count, future in enumerate(as_completed(futures)):
+                try:
+                    row = future.result()
+                except Exception as ex:
+                    failed.append(futures[future])
+                    print("{} of {} Stations | Station: {} | Failed: {!r}".format(count + 1,
+                          len(jobs), futures[future], ex))
+                    continue
+                writer.writerow(row)
+                f.flush()
+                print("{} of {} Stations | Station: {} | Success Rate: {:.2f}%".format(count + 1,
+                      len(jobs), row["ID"], row["success_rate"]))
+
+    if len(failed) > 0:
+        print("{} stations failed: {}".format(len(failed), failed))
+
+    return
+
+
+if __name__ == "__main__":
+
+    with open('EXPECTED_BALANCES.json') as json_data:
+        all_IDs = list(json.load(json_data).keys())
+
+    parser = argparse.ArgumentParser(description = "Train and evaluate an agent for every station.")
+    parser.add_argument("--ids", nargs = "+", default = all_IDs, help = "station IDs (default: all)")
+    parser.add_argument("--data", default = "linear", choices = ["linear", "random", "actual"])
+    parser.add_argument("--brain", default = "q", choices = ["q", "dqn", "plan"])
+    parser.add_argument("--model-based", action = "store_true")
+    parser.add_argument("--episodes", type = int, default = 1000)
+    parser.add_argument("--workers", type = int, default = os.cpu_count() or 1)
+    parser.add_argument("--output", default = "sweep_results.csv")
+    parser.add_argument("--seed", type = int, default = None)
+    parser.add_argument("--resume", action = "store_true",
+                        help = "skip stations already in the output file")
+    parser.add_argument("--policy-dir", default = None,
+                        help = "export each station's policy to <policy-dir>/<ID>.npz")
+    parser.add_argument("--early-stop", action = "store_true",
+                        help = "stop training a station once it has converged")
+    parser.add_argument("--stop-window", type = int, default = 100)
+    parser.add_argument("--stop-patience", type = int, default = 3)
+    parser.add_argument("--warm-dir", default = None,
+                        help = "start each station from the most similar station's policy in this directory")
+    parser.add_argument("--batch-size", type = int, default = 32, help = "DQN training batch size")
+    parser.add_argument("--memory-size", type = int, default = 100, help = "DQN replay buffer capacity")
+    parser.add_argument("--prioritized", action = "store_true", help = "prioritized DQN replay")
+    parser.add_argument("--checkpoint-every", type = int, default = 0,
+                        help = "save each station's training state every n episodes (0 = never)")
+    args = parser.parse_args()
+
+    sweep(args.ids, args.data, args.brain, args.model_based, args.episodes,
+          args.workers, args.output, resume = args.resume, seed = args.seed,
+          policy_dir = args.policy_dir,
+          early_stop = {"window": args.stop_window, "patience": args.stop_patience}
+                       if args.early_stop else None,
+          warm_dir = args.warm_dir, checkpoint_every = args.checkpoint_every,
+          dqn_options = {"batch_size": args.batch_size, "memory_size": args.memory_size,
+                         "prioritized": args.prioritized})
@@ -4,27 +4,106 @@
 
 This creates a class for training session with the following methods:
     - start()
+    - station_policy()
+    - initial_policy()
+    - run_session()
+    - run_sessions_parallel()
     - train_operator()
+    - run_plan()
+    - evaluate_operator()
+    - episode_log_file()
+    - checkpoint_file()
+    - write_checkpoint()
+    - read_checkpoint()
+    - restore_checkpoint()
     - get_timestamp()
     - cal_performance()
     - save_session_results()
+    - save_success_rate()
+    - stock_history_charts()
+    - save_policies()
+    - save_timings()
+    - save_histories()
     - reset_episode_action_history()
 
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import matplotlib.patches as mpatch
-from env import env
+from env import env, expected_balance
 from rl_brain import agent
-from dqn import DeepQNetwork
+from planner import planner, forecast_stock
+from policy import tabular_policy_arrays, dqn_policy_arrays, save_policy, similar_station_policy
+from profiling import phase_timer, session_profiler, write_timing_report
+from episode_log import episode_logger
+from history import episode_history
+from convergence import convergence_monitor
+from checkpoint import save_checkpoint, load_checkpoint, nest, unnest, get_random_state, \
+    set_random_state
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import datetime
+import time
 import os
 
+
+def run_session_job(job):
+    
+    '''
+    Worker entry point of trainer.run_sessions_parallel. Trains one session 
+    in a fresh trainer and returns the same tuple as trainer.run_session.
+    Input:
+        - job: (method, session size, station ID, seed, session index, settings)
+    '''
+    
+    method, eps, ID, seed, idx, settings = job
+    
+    np.random.seed(seed)
+    
+    session = trainer(settings["station_history"], settings["output_dir"], settings["verbose"],
+                      settings["print_every"], settings["log_every"], settings["keep_history"],
+                      settings["keep_k"], early_stop = settings["early_stop"],
+                      warm_start = settings["warm_start"], warm_dir = settings["warm_dir"],
+                      checkpoint_every = settings["checkpoint_every"],
+                      checkpoint_dir = settings["checkpoint_dir"], resume = settings["resume"],
+                      dqn_options = settings["dqn_options"])
+    session.configure(settings["stock_type"], settings["logging"], settings["env_debug"],
+                      settings["rl_debug"], settings["brain"], ID, settings["model_based"])
+    session.episodes = [None] * settings["num_sessions"]
+    session.profile = settings["profile"]
+    session.seed = seed
+    
+    return session.run_session(idx, eps, settings["warm_policy"])
+
+
 class trainer():
     
-    def __init__(self, station_history):
+    def __init__(self, station_history, output_dir = "./performance_log", verbose = 1,
+                 print_every = 100, log_every = 1, keep_history = 'all', keep_k = 100,
+                 charts = True, report_workers = 1, early_stop = None, warm_start = None,
+                 warm_dir = None, checkpoint_every = 0, checkpoint_dir = None, resume = False,
+                 dqn_options = None):
+        #verbose: console episode lines (0 = none, 1 = every print_every-th, 2 = all)
+        #log_every: write every log_every-th episode to the episode log (0 = no file)
+        #keep_history: hourly histories kept per session ('all', 'first_last', 
+        #              'every' k-th or a 'reservoir' of k episodes; see history.py)
+        #charts: draw the session charts (False = numeric result files only)
+        #report_workers: number of processes rendering the charts
+        #early_stop: None (always run every episode) or a dict of 
+        #            convergence_monitor settings, e.g. {"window": 100} (see convergence.py)
+        #warm_start: None (every session starts from scratch), 'session' (each 
+        #            session continues from the previous session's Q table or 
+        #            DQN weights), 'station' (every session starts from the 
+        #            policy of the most similar station in warm_dir) or 'both'
+        #            (the first session from the station, the next ones from 
+        #            the previous session)
+        #warm_dir: directory of <ID>.npz policies, e.g. from sweep.py --policy-dir
+        #checkpoint_every: save the training state of a session every 
+        #                  checkpoint_every episodes and at its end (0 = never)
+        #checkpoint_dir: where the checkpoints go (default <output_dir>/checkpoints)
+        #resume: continue each session from its checkpoint, if there is one
+        #dqn_options: None (defaults) or a dict of DQN agent settings, e.g. 
+        #             {"batch_size": 32, "memory_size": 1000, "prioritized": True}
+        #             (see rl_brain.agent and replay_buffer.py)
         
         # Session Properties
         self.episodes = []
@@ -39,24 +118,89 @@ class trainer():
         self.ID = None
         self.method = None
         self.station_history = station_history
+        self.output_dir = output_dir
+        self.verbose = verbose
+        self.print_every = print_every
+        self.log_every = log_every
+        self.keep_history = keep_history
+        self.keep_k = keep_k
+        self.charts = charts
+        self.report_workers = report_workers
+        self.early_stop = early_stop
+        self.warm_start = warm_start
+        self.warm_dir = warm_dir
+        self.warm_policy = None     # policy arrays of the similar station, if any
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.dqn_options = dqn_options
         
         # Performance Metric
         self.success_ratio = 0
         self.rewards = []  # [[r from session 1], [r from session 2] ...]
         self.avg_rewards = [] #[np.mean([r from session 1]), np.mean([r from session 2])...]
         self.final_stocks = [] # [[stock from session 1], [stock from session 2] ...]
-        self.episode_action_history = []
+        self.episode_action_history = []  # episode_history of the running session
         self.episode_stock_history = []
-        self.session_action_history = []
+        self.session_action_history = []  # [episode_history of session 1, ...]
         self.session_stock_history = []
         self.q_tables = []
+        self.policies = []
+        self.timings = []
+        self.convergence = [] # convergence_monitor summary of each session (early_stop only)
+        self.profile = None
+        self.seed = None    # seed of start() (None = not reproducible)
         self.actions = [-10, -3, -1, 0]
         
     
-    def start(self, episodes, stock_type, logging, env_debug, rl_debug, brain, ID, model_based):
-        #brain: which method to use. Q learning vs DQN
+    def start(self, episodes, stock_type, logging, env_debug, rl_debug, brain, ID, model_based,
+              workers = 1, seed = None, profile = None):
+        #brain: which method to use. Q learning ('q'), DQN ('dqn') or the
+        #       dynamic-programming planner ('plan', see planner.py)
+        #workers: number of processes to run the sessions in (1 = in this process)
+        #seed: base seed for the sessions; each session gets its own seed
+        #profile: None, 'cprofile' or 'sample' profiling of each session
         
         self.episodes = episodes
+        self.profile = profile
+        self.seed = seed
+        self.configure(stock_type, logging, env_debug, rl_debug, brain, ID, model_based)
+        
+        if self.brain not in ['q', 'dqn', 'plan']:
+            print("Error: pick correct brain")
+            return
+        
+        self.warm_policy = self.station_policy()
+        
+        # a session that continues from the previous one has to wait for it
+        chained = self.warm_start in ['session', 'both'] and self.brain != 'plan'
+        if workers > 1 and chained:
+            print("Warm start from the previous session: running the sessions one after another")
+        
+        if workers > 1 and not chained:
+            results = self.run_sessions_parallel(workers, seed)
+        else:
+            if seed is not None:
+                np.random.seed(seed)
+            results = []
+            for idx, eps in enumerate(self.episodes):
+                results.append(self.run_session(idx, eps, self.initial_policy(results)))
+        
+        for result in results:
+            self.log_session(*result)
+        
+        if logging == True:
+            if self.brain != 'dqn':
+                self.save_session_results(self.get_timestamp(replace = True))
+            else:
+                self.save_session_results_dqn(self.get_timestamp(replace = True))
+            
+        return
+    
+    
+    def configure(self, stock_type, logging, env_debug, rl_debug, brain, ID, model_based):
+        
+        # set the session properties shared by every training session
         self.stock_type = stock_type
         self.logging = logging
         self.env_debug = env_debug
@@ -69,62 +213,193 @@ class trainer():
             self.method = 'QLN'
         elif brain == 'q' and model_based == True:
             self.method = 'FCT'
+        elif brain == 'plan' and model_based == False:
+            self.method = 'DP'      # perfect information: the ground-truth optimum
+        elif brain == 'plan' and model_based == True:
+            self.method = 'DPF'     # planned on the EXPECTED_BALANCES forecast
         else:
             self.method = 'DQN'
+    
+    
+    def station_policy(self):
+        
+        '''
+        Output:
+            - policy arrays of the station closest to self.ID in warm_dir 
+              (same brain), or None
+        '''
         
-        idx = 0
+        if self.warm_start not in ['station', 'both'] or self.brain == 'plan':
+            return None
+        if self.warm_dir is None:
+            print("Error: warm start from a station needs a policy directory")
+            return None
         
-        for eps in self.episodes:
+        kind = "dqn" if self.brain == 'dqn' else "tabular"
+        station, arrays = similar_station_policy(self.warm_dir, self.ID, expected_balance, kind)
+        if station is None:
+            print("No {} policy of another station in {}: starting from scratch".format(kind, self.warm_dir))
+        else:
+            print("Warm start from the policy of station {}".format(station))
         
-            # Initiate new evironment and RL agent
-            self.bike_station = env(self.stock_type, debug = self.env_debug, ID = self.ID,
-                                    station_history = self.station_history)
-            self.sim_stock.append(self.bike_station.get_sim_stock())
+        return arrays
+    
+    
+    def initial_policy(self, results):
+        
+        # policy arrays the next session starts from (None = from scratch)
+        if self.warm_start in ['session', 'both'] and len(results) > 0:
+            return results[-1][6]
+        
+        return self.warm_policy
+    
+    
+    def create_session(self):
+        
+        # Initiate new evironment and RL agent
+        self.bike_station = env(self.stock_type, debug = self.env_debug, ID = self.ID,
+                                station_history = self.station_history)
 
-            if self.brain == 'q':
-                self.operator = agent(epsilon = 0.9, lr = 0.001, gamma = 0.9, 
-                                  current_stock = self.bike_station.current_stock(), 
-                                  debug = self.rl_debug,
-                                  expected_stock = self.bike_station.get_expected_stock(),
-                                  model_based = model_based)
-            elif self.brain == 'dqn':
-                self.operator = agent(epsilon = 0.9, lr = 0.001, gamma = 0.9, 
-                                  current_stock = self.bike_station.current_stock(), 
-                                  debug = self.rl_debug,
-                                  expected_stock = self.bike_station.get_expected_stock(),
-                                  model_based = model_based,
-                                  dqn_flag = True,
-                                  n_features = self.bike_station.n_features)
+        if self.brain == 'q':
+            self.operator = agent(epsilon = 0.9, lr = 0.001, gamma = 0.9, 
+                              current_stock = self.bike_station.current_stock(), 
+                              debug = self.rl_debug,
+                              expected_stock = self.bike_station.get_expected_stock(),
+                              model_based = self.model_based)
+        elif self.brain == 'dqn':
+            self.operator = agent(epsilon = 0.9, lr = 0.001, gamma = 0.9, 
+                              current_stock = self.bike_station.current_stock(), 
+                              debug = self.rl_debug,
+                              expected_stock = self.bike_station.get_expected_stock(),
+                              model_based = self.model_based,
+                              dqn_flag = True,
+                              n_features = self.bike_station.n_features,
+                              **(self.dqn_options or {}))
+        elif self.brain == 'plan':
+            self.operator = planner(self.bike_station.actions, debug = self.rl_debug)
+            if self.model_based == True:
+                base = forecast_stock(self.bike_station.bike_stock_sim[0],
+                                      self.bike_station.exp_bike_stock_sim[:-1])
             else:
-                print("Error: pick correct brain")
-                break
-            
-            # Train the RL agent and collect performance stats
-            rewards, final_stocks = self.train_operator(idx, len(self.episodes), eps,
-            logging = self.logging, brain = self.brain, model_based = self.model_based)
-            
-            # Log the results from this training session
-            self.rewards.append(rewards)
-            self.avg_rewards.append(np.mean(rewards))
-            self.final_stocks.append(final_stocks)
-            #self.q_tables.append(self.operator.get_q_table())
-            self.session_action_history.append(self.episode_action_history)
-            self.session_stock_history.append(self.episode_stock_history)
-            self.reset_episode_history()
-            
-            # Destroy the environment and agent objects
-            self.bike_station = None
-            self.operator = None
-            
-            idx += 1
+                base = self.bike_station.bike_stock_sim
+            self.operator.plan(base)
         
-        if logging == True:
-            if self.brain == 'q':
-                self.save_session_results(self.get_timestamp(replace = True))
+        return self.bike_station.get_sim_stock()
+    
+    
+    def run_session(self, idx, eps, initial = None):
+        
+        '''
+        This function trains a new RL agent on a new bike station for one 
+        training session.
+        Input:
+            - idx: index of the session in self.episodes
+            - eps: number of episodes to train in this session
+            - initial: policy arrays to warm start the agent from (None = 
+                       start from scratch)
+        Output:
+            - rewards, final_stocks, sim_stock, action_history, stock_history,
+              q_table (q_table object, tabular brains only), policy (exported arrays),
+              timing (time per training phase and optional profile report),
+              convergence (early stopping summary or None)
+        '''
+        
+        sim_stock = self.create_session()
+        if initial is not None and self.brain != 'plan':
+            self.operator.warm_start(initial)
+        
+        # Train the RL agent and collect performance stats (the planner needs
+        # no training: its schedule is run once)
+        with session_profiler(self.profile) as profiler:
+            if self.brain == 'plan':
+                rewards, final_stocks = self.run_plan(idx, len(self.episodes))
             else:
-                self.save_session_results_dqn(self.get_timestamp(replace = True))
-            
-        return
+                rewards, final_stocks = self.train_operator(idx, len(self.episodes), eps,
+                logging = self.logging, brain = self.brain, model_based = self.model_based)
+        
+        # episode the session stopped at (None: ran every episode)
+        convergence = self.monitor.summary() if self.monitor is not None else None
+        
+        timing = self.timer.summary()
+        timing["profile_mode"] = self.profile
+        timing["profile"] = profiler.report()
+        
+        action_history = self.episode_action_history
+        stock_history = self.episode_stock_history
+        self.reset_episode_history()
+        
+        # Freeze the trained agent into an inference-only policy
+        if self.brain == 'q':
+            q_table = self.operator.q_table
+            policy = tabular_policy_arrays(self.operator.q_table, self.model_based)
+        elif self.brain == 'plan':
+            # the plan depends on the hour, not on the stock alone
+            q_table = None
+            policy = None
+        else:
+            q_table = None
+            policy = dqn_policy_arrays(self.operator.dqn_net)
+        
+        # Destroy the environment and agent objects
+        self.bike_station = None
+        self.operator = None
+        
+        return rewards, final_stocks, sim_stock, action_history, stock_history, q_table, policy, \
+            timing, convergence
+    
+    
+    def log_session(self, rewards, final_stocks, sim_stock, action_history, stock_history,
+                    q_table = None, policy = None, timing = None, convergence = None):
+        
+        # Log the results from one training session
+        self.sim_stock.append(sim_stock)
+        self.rewards.append(rewards)
+        self.avg_rewards.append(np.mean(rewards))
+        self.final_stocks.append(final_stocks)
+        if q_table is not None:
+            self.q_tables.append(q_table)
+        if policy is not None:
+            self.policies.append(policy)
+        if timing is not None:
+            self.timings.append(timing)
+        self.convergence.append(convergence)
+        self.session_action_history.append(action_history)
+        self.session_stock_history.append(stock_history)
+    
+    
+    def run_sessions_parallel(self, workers, seed = None):
+        
+        '''
+        This function sends every session in self.episodes to a process pool
+        as a (method, session size, station ID, seed) job and gathers the 
+        results back in session order.
+        '''
+        
+        seeds = np.random.SeedSequence(seed).generate_state(len(self.episodes))
+        settings = {"stock_type": self.stock_type, "logging": self.logging,
+                    "env_debug": self.env_debug, "rl_debug": self.rl_debug,
+                    "brain": self.brain, "model_based": self.model_based,
+                    "station_history": self.station_history,
+                    "num_sessions": len(self.episodes),
+                    "profile": self.profile, "output_dir": self.output_dir,
+                    "verbose": self.verbose, "print_every": self.print_every,
+                    "log_every": self.log_every, "keep_history": self.keep_history,
+                    "keep_k": self.keep_k, "early_stop": self.early_stop,
+                    "warm_start": self.warm_start, "warm_dir": self.warm_dir,
+                    "warm_policy": self.warm_policy,
+                    "checkpoint_every": self.checkpoint_every,
+                    "checkpoint_dir": self.checkpoint_dir, "resume": self.resume,
+                    "dqn_options": self.dqn_options}
+        jobs = [(self.method, eps, self.ID, int(seeds[idx]), idx, settings)
+                for idx, eps in enumerate(self.episodes)]
+        
+        # spawn rather than fork so that TensorFlow state is never shared
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers = min(workers, len(jobs)),
+                                 mp_context = context) as pool:
+            results = list(pool.map(run_session_job, jobs))
+        
+        return results
     
     
     def train_operator(self, idx, num_sessions, episodes, logging, brain, model_based):
@@ -145,74 +420,305 @@ class trainer():
         reward_list = []
         final_stocks = []
         step = 0
-        
-        for eps in range(episodes):
-            
-            self.bike_station.reset()
+        converged = False
+        
+        # time per phase of the loop (see profiling.py), kept in self.timer
+        self.timer = timer = phase_timer()
+        
+        # hourly actions and stocks of the kept episodes, in preallocated arrays
+        # (the same episodes for both, reproducible from the seed and session)
+        hours = len(self.bike_station.bike_stock_sim)
+        seed = np.random.SeedSequence(self.seed, spawn_key = (idx,))
+        self.episode_action_history = episode_history(episodes, hours, self.keep_history,
+                                                      self.keep_k, np.int32, seed)
+        self.episode_stock_history = episode_history(episodes, hours, self.keep_history,
+                                                     self.keep_k, np.int32, seed)
+        
+        # continue at the episode after the last checkpoint
+        checkpoint = self.read_checkpoint(idx, episodes) if self.resume == True else None
+        
+        # buffered episode rows and sampled console output (see episode_log.py);
+        # the log of an earlier run is replaced unless this one resumes it, and
+        # buffered rows are written even if training raises
+        with episode_logger(self.episode_log_file(idx), self.method, self.ID,
+                            verbose = self.verbose, print_every = self.print_every,
+                            log_every = self.log_every, append = checkpoint is not None) as logger:
+        
+            # stop once rewards, success ratio and Q values plateau (see convergence.py)
+            self.monitor = monitor = None
+            snapshot = None
+            if self.early_stop is not None:
+                self.monitor = monitor = convergence_monitor(**self.early_stop)
+                snapshot = self.operator.parameter_snapshot()
+        
+            if checkpoint is not None:
+                reward_list = checkpoint["rewards"].tolist()
+                final_stocks = checkpoint["final_stocks"].tolist()
+                step = int(checkpoint["step"])
+                converged = bool(checkpoint["converged"])
+                if "snapshot/0" in checkpoint:
+                    saved = unnest("snapshot", checkpoint)
+                    snapshot = [saved[str(i)] for i in range(len(saved))]
+                self.restore_checkpoint(checkpoint, logger)
+                print("{} of {} Session | Resuming at episode {} of {}".format(idx, num_sessions,
+                      len(reward_list), episodes))
+        
+            for eps in range(episodes if converged else len(reward_list), episodes):
+            
+                t = time.perf_counter()
+                self.bike_station.reset()
+                t = timer.lap("env_reset", t)
                 
-            while True:
+                while True:
                 
-                # Agent picks an action (number of bikes to move)
-                # Agent sends the action to bike station environment
-                # Agent gets feedback from the environment (e.g. reward of the action, new bike stock after the action, etc.)
-                # Agent "learn" the feedback by updating its Q-Table (state, action, reward)
-                # Repeat until end of day (23 hours)
-                # Reset bike station environment to start a new day, repeat all
+                    # Agent picks an action (number of bikes to move)
+                    # Agent sends the action to bike station environment
+                    # Agent gets feedback from the environment (e.g. reward of the action, new bike stock after the action, etc.)
+                    # Agent "learn" the feedback by updating its Q-Table (state, action, reward)
+                    # Repeat until end of day (23 hours)
+                    # Reset bike station environment to start a new day, repeat all
                 
                 
-                if self.brain == 'q':
-                    action = self.operator.choose_action(self.bike_station.get_old_stock(),
-                                                     self.bike_station.get_expected_stock())
-                    current_hour, old_stock, new_stock, expected_stock, _, reward, done, game_over = self.bike_station.ping(action)
+                    if self.brain != 'dqn':
+                        action = self.operator.choose_action(self.bike_station.get_old_stock(),
+                                                         self.bike_station.get_expected_stock())
+                        t = timer.lap("choose_action", t)
+                        current_hour, old_stock, new_stock, expected_stock, _, reward, done, game_over = self.bike_station.ping(action)
+                        t = timer.lap("env_step", t)
 
-                else:
-                    action = self.operator.choose_action(self.bike_station.get_old_stock(), self.bike_station.get_expected_stock())
-                    current_hour, old_stock, new_stock, reward, done = self.bike_station.ping_dqn(action)
-                    self.operator.dqn_net.store_transition(old_stock, action, reward, new_stock)
-                    if step > 50 and (step % 10 == 0):
-                        self.operator.dqn_net.learn()
+                    else:
+                        action = self.operator.choose_action(self.bike_station.get_old_stock(), self.bike_station.get_expected_stock())
+                        t = timer.lap("choose_action", t)
+                        current_hour, old_stock, new_stock, reward, done = self.bike_station.ping_dqn(action)
+                        t = timer.lap("env_step", t)
+                        self.operator.dqn_net.store_transition(old_stock, action, reward, new_stock, done)
+                        t = timer.lap("dqn_store", t)
+                        if step > 50 and (step % 10 == 0):
+                            self.operator.dqn_net.learn()
+                            t = timer.lap("dqn_learn", t)
 
-                #observation_, reward, done = self.bike_station.ping(action)
-                if done == True:
+                    #observation_, reward, done = self.bike_station.ping(action)
+                    if done == True:
                     
-                    print("{} of {} Session | Episode: {} | Final Stock: {} |Final Reward: {:.2f}".format(idx, 
-                          num_sessions, eps, old_stock, rewards))
-
+                        logger.log(idx, num_sessions, eps, old_stock, rewards)
+                        t = timer.lap("episode_log", t)
                     
-                    reward_list.append(rewards)
-                    final_stocks.append(old_stock)
-                    rewards = 0
+                        reward_list.append(rewards)
+                        final_stocks.append(old_stock)
                     
-                    # Log session action history by episode
-                    if brain == 'q':
-                        self.episode_action_history.append(self.operator.get_hourly_actions())
-                        self.episode_stock_history.append(self.operator.get_hourly_stocks())
-                        self.operator.reset_hourly_history()
-                    else:
-                        self.episode_stock_history.append(self.operator.get_hourly_stocks());
-                        self.operator.reset_hourly_history()
+                        if monitor is not None and monitor.update(rewards, old_stock):
+                            converged = monitor.check(self.operator.parameter_change(snapshot))
+                            snapshot = self.operator.parameter_snapshot()
+                    
+                        rewards = 0
+                    
+                        # Log session action history by episode
+                        if brain != 'dqn':
+                            self.episode_action_history.add(self.operator.get_hourly_actions())
+                            self.episode_stock_history.add(self.operator.get_hourly_stocks())
+                            self.operator.reset_hourly_history()
+                        else:
+                            self.episode_stock_history.add(self.operator.get_hourly_stocks());
+                            self.operator.reset_hourly_history()
+                    
+                        t = timer.lap("history_logging", t)
                                     
-                    break
+                        break
 
 
-                if brain == 'q':
+                    if brain != 'dqn':
 
-                    self.operator.learn(old_stock, action, reward, new_stock, expected_stock, game_over)
+                        self.operator.learn(old_stock, action, reward, new_stock, expected_stock, game_over)
+                        t = timer.lap("q_update", t)
 
 
-                step +=1
-                rewards += reward
+                    step +=1
+                    rewards += reward
                 
-                # Log hourly action history by each episode
-
-
-            with open('dqn_log.txt', 'a') as f:
-                f.write("{} of {} Session | Episode: {} | Final Stock: {} |Final Reward: {:.2f} \n".format(idx, 
-                    num_sessions, eps, old_stock, rewards))
+                    # Log hourly action history by each episode
 
+                if converged == True:
+                    print("{} of {} Session | Converged after {} of {} episodes".format(idx, 
+                          num_sessions, eps + 1, episodes))
+                    break
+            
+                if self.checkpoint_every > 0 and (eps + 1) % self.checkpoint_every == 0 and \
+                        eps + 1 < episodes:
+                    self.write_checkpoint(idx, episodes, reward_list, final_stocks, step, converged,
+                                          snapshot, logger)
+                    timer.lap("checkpoint", t)
+        
+            if self.checkpoint_every > 0:
+                self.write_checkpoint(idx, episodes, reward_list, final_stocks, step, converged,
+                                      snapshot, logger)
+        
                             
         return reward_list, final_stocks
     
+    def run_plan(self, idx, num_sessions):
+        
+        '''
+        This function runs the planned schedule of the 'plan' brain for one 
+        day on the bike station and records it as the only episode of the 
+        session, without episode logging or early stopping.
+        Output:
+            - reward_list: [reward of the day] (same convention as 
+                           train_operator)
+            - final_stocks: [final stock of the day]
+        '''
+        
+        self.timer = timer = phase_timer()
+        self.monitor = None
+        hours = len(self.bike_station.bike_stock_sim)
+        self.episode_action_history = episode_history(1, hours, dtype = np.int32)
+        self.episode_stock_history = episode_history(1, hours, dtype = np.int32)
+        
+        t = time.perf_counter()
+        self.bike_station.reset()
+        rewards = 0
+        
+        while True:
+            
+            action = self.operator.choose_action(self.bike_station.get_old_stock(),
+                                                 self.bike_station.get_expected_stock())
+            _, old_stock, _, _, _, reward, done, _ = self.bike_station.ping(action)
+            
+            if done == True:
+                break
+            
+            rewards += reward
+        
+        self.episode_action_history.add(self.operator.get_hourly_actions())
+        self.episode_stock_history.add(self.operator.get_hourly_stocks())
+        self.operator.reset_hourly_history()
+        timer.lap("plan_schedule", t)
+        
+        print("{} of {} Session | {} Schedule | Final Stock: {} | Reward: {:.2f}".format(idx,
+              num_sessions, self.method, old_stock, rewards))
+        
+        return [rewards], [old_stock]
+    
+    
+    def evaluate_operator(self):
+        
+        '''
+        This function runs one greedy episode of the trained agent on the
+        current bike station, without learning.
+        Output:
+            - rewards: total reward of the episode (same convention as 
+                       train_operator)
+            - final_stock: final stock of the episode
+        '''
+        
+        epsilon = self.operator.epsilon
+        self.operator.epsilon = 1 # always pick the best action
+        self.bike_station.reset()
+        rewards = 0
+        
+        while True:
+            
+            action = self.operator.choose_action(self.bike_station.get_old_stock(),
+                                                 self.bike_station.get_expected_stock())
+            if self.brain != 'dqn':
+                _, old_stock, _, _, _, reward, done, _ = self.bike_station.ping(action)
+            else:
+                _, old_stock, _, reward, done = self.bike_station.ping_dqn(action)
+            
+            if done == True:
+                break
+            
+            rewards += reward
+        
+        self.operator.reset_hourly_history()
+        self.operator.epsilon = epsilon
+        
+        return rewards, old_stock
+    
+    
+    def episode_log_file(self, idx):
+        
+        # <output_dir>/episode_logs/<method>_<ID>_session_<idx>.csv, rewritten
+        # by every run (appended to when resuming from a checkpoint)
+        if self.log_every == 0:
+            return None
+        
+        return os.path.join(self.output_dir, "episode_logs", 
+                            "{}_{}_session_{}.csv".format(self.method, self.ID, idx))
+    
+    
+    def checkpoint_file(self, idx):
+        
+        # <checkpoint_dir>/<method>_<ID>_session_<idx>.npz (see checkpoint.py)
+        folder = self.checkpoint_dir
+        if folder is None:
+            folder = os.path.join(self.output_dir, "checkpoints")
+        
+        return os.path.join(folder, "{}_{}_session_{}.npz".format(self.method, self.ID, idx))
+    
+    
+    def write_checkpoint(self, idx, episodes, reward_list, final_stocks, step, converged,
+                         snapshot, logger):
+        
+        '''
+        This function saves the training state of the running session between 
+        two episodes: environment, agent (Q table or DQN networks, optimizer 
+        and replay memory), histories, early stopping, timers, the NumPy 
+        random state and the episode counters.
+        '''
+        
+        state = {"method": np.array(self.method), "ID": np.array(str(self.ID)),
+                 "episodes": np.array(episodes), "step": np.array(step),
+                 "converged": np.array(converged),
+                 "rewards": np.array(reward_list, dtype = np.float64),
+                 "final_stocks": np.array(final_stocks, dtype = np.int64),
+                 "log_size": np.array(logger.tell())}
+        state.update(nest("env", self.bike_station.get_state()))
+        state.update(nest("agent", self.operator.get_state()))
+        state.update(nest("action_history", self.episode_action_history.get_state()))
+        state.update(nest("stock_history", self.episode_stock_history.get_state()))
+        state.update(nest("timer", self.timer.get_state()))
+        state.update(nest("random", get_random_state()))
+        if self.monitor is not None:
+            state.update(nest("monitor", self.monitor.get_state()))
+        if snapshot is not None:
+            state.update(nest("snapshot", {str(i): np.asarray(a) for i, a in enumerate(snapshot)}))
+        
+        save_checkpoint(self.checkpoint_file(idx), state)
+    
+    
+    def read_checkpoint(self, idx, episodes):
+        
+        # the checkpoint of this session, or None if there is none that matches
+        fname = self.checkpoint_file(idx)
+        if not os.path.exists(fname):
+            return None
+        
+        checkpoint = load_checkpoint(fname)
+        if str(checkpoint["method"]) != self.method or str(checkpoint["ID"]) != str(self.ID) or \
+                int(checkpoint["episodes"]) != episodes:
+            print("Checkpoint {} is for another session: starting from scratch".format(fname))
+            return None
+        
+        return checkpoint
+    
+    
+    def restore_checkpoint(self, checkpoint, logger):
+        
+        self.bike_station.set_state(unnest("env", checkpoint))
+        self.operator.set_state(unnest("agent", checkpoint))
+        self.episode_action_history.set_state(unnest("action_history", checkpoint))
+        self.episode_stock_history.set_state(unnest("stock_history", checkpoint))
+        self.timer.set_state(unnest("timer", checkpoint))
+        if self.monitor is not None and "monitor/episode" in checkpoint:
+            self.monitor.set_state(unnest("monitor", checkpoint))
+        
+        # drop the episode rows logged after the checkpoint
+        logger.truncate(int(checkpoint["log_size"]))
+        
+        # last, so that nothing above draws from it
+        set_random_state(unnest("random", checkpoint))
+    
+    
     def get_timestamp(self, replace):
         
         if replace == True:
@@ -263,10 +769,12 @@ class trainer():
             - line chart of reward history by session
             - Q Table of each session
             - Comparison Line Chart of First and Last Episode Hourly Actions
+        Charts are skipped if self.charts is False and rendered by 
+        self.report_workers processes otherwise (see report.py).
         '''
         
         # --- create a session folder ---
-        dir_path = "./performance_log/" + timestamp
+        dir_path = os.path.join(self.output_dir, timestamp)
         
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
@@ -274,82 +782,43 @@ class trainer():
         successful_stocking = self.cal_performance()
         
         # --- Write Success Rate to File ---
-        fname = dir_path + "/success_rate - " + timestamp + ".txt"
+        self.save_success_rate(dir_path, timestamp, successful_stocking)
+
+        # --- Save Q tables --- 
         
-        with open(fname, 'w') as f:
+        for session in range(len(self.q_tables)):
             
-            f.write("Logged at {}".format(self.get_timestamp(replace = False)))
-            f.write("\n")
-            f.write("This training session ran episodes: {}".format(self.episodes))
-            f.write("\n")
+            self.q_tables[session].to_csv(dir_path + "/q_table_session_" + \
+                        str(session) + timestamp + ".csv")
         
-            for session in range(len(successful_stocking)):
-                f.write("Session {} | Episodes: {} | Success Rate: {:.2f}%".format(session, 
-                        self.episodes[session], successful_stocking[session]))
-                f.write("\n")
+        # --- Save inference-only policies ---
         
-        # --- Plot Overall Success Rate by Episode ---
+        self.save_policies(dir_path, timestamp)
+        self.save_timings(dir_path, timestamp)
+        self.save_histories(dir_path, timestamp)
+        
+        if self.charts == False:
+            return
         
-        title = "% of Successful Rebalancing - " + timestamp
+        # matplotlib is only loaded when charts are drawn
+        import report
         
-        fig1 = plt.figure()
-        plt.plot(self.episodes, successful_stocking)
-        plt.xlabel("Episodes")
-        plt.ylabel("% Success Rate")
-        plt.title(title)
-        fig1.savefig(dir_path + "/session_success_rate_" + timestamp)
+        # --- Plot Overall Success Rate by Episode ---
+        
+        jobs = [(report.success_rate_chart, (dir_path + "/session_success_rate_" + timestamp, 
+                 self.episodes, successful_stocking, "% of Successful Rebalancing - " + timestamp))]
         
         # --- Plot Reward History by Training Session ---
         
         for session in range(len(self.rewards)):
             
-            fig = plt.figure(figsize=(10, 8))
-            
             title = "Reward History by Training Session " + str(session) + " - " + timestamp
-            
-            x_axis = [x for x in range(self.episodes[session])]
-            plt.plot(x_axis, self.rewards[session], label = "Session "+str(session))
-            plt.legend()
-            plt.xlabel("Episode")
-            plt.ylabel("Reward")
-            plt.title(title)
-            fig.savefig(dir_path + "/reward_history_session_" + \
-                        str(session) + timestamp)
+            jobs.append((report.reward_history_chart, (dir_path + "/reward_history_session_" + \
+                         str(session) + timestamp, self.rewards[session], session, title)))
             
         # --- Plot Average Reward History by Training Session ---
-        figR = plt.figure(figsize=[10, 8])
-        lengths = [len(r) for r in self.rewards]
-        means = [np.mean(r) for r in self.rewards]
-        if len(self.rewards) > 1:
-            increment = (lengths[1]-lengths[0])/20
-        else:
-            increment = lengths[0]/20
-
-        for reward_list in self.rewards:
-            Q3 = np.percentile(reward_list, 75)
-            Q1 = np.percentile(reward_list, 25)
-            M = np.mean(reward_list)
-            location = len(reward_list)
-            plt.plot([location-increment, location+increment], [Q1, Q1], 'k-')
-            plt.plot([location-increment, location+increment], [Q3, Q3], 'k-')
-            plt.plot([location, location], [Q1, Q3], 'k-')
-            plt.scatter(location, M, s=100, color='dodgerblue')           
-
-        plt.xlabel('Number of Episodes in Session')
-        plt.ylabel('Average Reward per Episode')
-        plt.title('Average Reward vs. Session Size', size=20)
-        plt.xticks(lengths)
-
-        plt.plot(lengths, means, linestyle='--')
         
-        figR.savefig(dir_path + "/reward_averages")
-
-        # --- Save Q tables --- 
-        
-        for session in range(len(self.q_tables)):
-            
-            self.q_tables[session].to_csv(dir_path + "/q_table_session_" + \
-                        str(session) + timestamp + ".csv")
+        jobs.append((report.reward_averages_chart, (dir_path + "/reward_averages", self.rewards)))
         
         # --- Comparison Line Chart of First and Last Episode for each Session ---
         
@@ -358,79 +827,23 @@ class trainer():
         if not os.path.exists(file_path):
             os.makedirs(file_path)       
         
-        
         for session in range(len(self.session_action_history)):
             
-            first_eps_idx = 0
-            last_eps_idx = len(self.session_action_history[session])-1
-            
-            fig = plt.figure(figsize=(10, 8))
-            title = "Session " + str(session) + " - Hourly Action of Eps " + str(first_eps_idx) + " and Eps " + str(last_eps_idx)
-            
-            x_axis = [x for x in range(len(self.session_action_history[session][0]))]
-            plt.plot(x_axis, self.session_action_history[session][0], label = "Eps 0")
-            plt.plot(x_axis, self.session_action_history[session][-1], 
-                     label = "Eps " + str(last_eps_idx))
-            
-            plt.legend()
-            plt.xlabel("Hours")
-            plt.ylabel("Number of Bikes Moved")
-            plt.title(title)
-            
-            fig.savefig(file_path + "/action_history_" + str(session) + timestamp)
-        
+            kept_eps, actions = self.session_action_history[session].kept()
+            jobs.append((report.action_history_chart, (file_path + "/action_history_" + \
+                         str(session) + timestamp, session, kept_eps, actions)))
         
         # --- Comparison Line Chart of Simulated and Rebalanced Bike Stock --- #
-        file_path = dir_path + "/stock_history"
         
-        if not os.path.exists(file_path):
-            os.makedirs(file_path)       
+        jobs += self.stock_history_charts(dir_path, timestamp, "", "Session ")
         
-        
-        for session in range(len(self.session_stock_history)):
-            
-            first_eps_idx = 0
-            last_eps_idx = len(self.session_action_history[session])-1
-            
-            fig = plt.figure(figsize=(10, 8))
-            title = "[" + self.method + "]" + "Session " + str(session) + " - Original vs. Balanced Bike Stock after " + str(first_eps_idx) + " and Eps " + str(last_eps_idx)
-            
-            x_axis = [x for x in range(len(self.session_stock_history[session][0]))]
-            plt.plot(x_axis, self.sim_stock[session], label = "Original without Balancing")
-            plt.plot(x_axis, self.session_stock_history[session][0], label = "Balanced Bike Stock - Eps 0")
-            plt.plot(x_axis, self.session_stock_history[session][-1], 
-                     label = "Balanced Bike Stock - Eps " + str(last_eps_idx))
-            
-            plt.axhline(y = 50, c = "r", ls = "-", label = "Upper Stock Limit")
-            plt.axhline(y = 35, c = "m", ls = "--", label = "Upper Target Limit")
-            plt.axhline(y = 15, c = "m", ls = "--", label = "Lower Target Limit")
-            plt.axhline(y = 0, c = "r", ls = "-", label = "Lower Stock Limit")
-            
-            plt.legend()
-            plt.xlabel("Hours")
-            plt.ylabel("Number of Bike Stock")
-            plt.title(title)
-            
-            fig.savefig(file_path + "/stock_history_" + str(session) + timestamp)
+        report.render_charts(jobs, self.report_workers)
         
         return
 
-    def save_session_results_dqn(self, timestamp):
-        dir_path = "./performance_log/" + timestamp
-        
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-            
-        # --- Comparison Line Chart of Simulated and Rebalaned Bike Stock --- #
-        file_path = dir_path + "/stock_history"
-        
-        if not os.path.exists(file_path):
-            os.makedirs(file_path)       
-        
-        
-        successful_stocking = self.cal_performance()
+
+    def save_success_rate(self, dir_path, timestamp, successful_stocking):
         
-        # --- Write Success Rate to File ---
         fname = dir_path + "/success_rate - " + timestamp + ".txt"
         
         with open(fname, 'w') as f:
@@ -443,45 +856,97 @@ class trainer():
             for session in range(len(successful_stocking)):
                 f.write("Session {} | Episodes: {} | Success Rate: {:.2f}%".format(session, 
                         self.episodes[session], successful_stocking[session]))
+                if self.brain == 'plan':
+                    f.write(" | Planned Schedule Run Once")
+                elif len(self.rewards[session]) < self.episodes[session]:
+                    f.write(" | Stopped Early at Episode: {}".format(len(self.rewards[session])))
                 f.write("\n")
-
-            # --- Plot Overall Success Rate by Episode ---
+    
+    
+    def stock_history_charts(self, dir_path, timestamp, prefix, label):
         
-        title = "% of Successful Rebalancing - " + timestamp
+        # chart jobs comparing the simulated stock to the first and last kept episodes
+        import report
         
-        fig1 = plt.figure()
-        plt.plot(self.episodes, successful_stocking)
-        plt.xlabel("Episodes")
-        plt.ylabel("% Success Rate")
-        plt.title(title)
-        fig1.savefig(dir_path + "/session_success_rate_" + timestamp)
-
+        file_path = dir_path + "/stock_history"
+        
+        if not os.path.exists(file_path):
+            os.makedirs(file_path)
+        
+        jobs = []
         for session in range(len(self.session_stock_history)):
             
-            first_eps_idx = 0
-            last_eps_idx = len(self.session_stock_history[session])-1
-            
-            fig = plt.figure(figsize=(10, 8))
-            title = "[" + self.method + "]" + " Session " + str(session) + " - Original vs. Balanced Bike Stock after " + str(first_eps_idx) + " and Eps " + str(last_eps_idx)
+            kept_eps, stocks = self.session_stock_history[session].kept()
+            title = "[" + self.method + "]" + label + str(session) + " - Original vs. Balanced Bike Stock after " + str(kept_eps[0]) + " and Eps " + str(kept_eps[-1])
+            jobs.append((report.stock_history_chart, (file_path + "/stock_history_" + prefix + \
+                         str(session) + timestamp, title, self.sim_stock[session], kept_eps, stocks)))
+        
+        return jobs
+
+    def save_policies(self, dir_path, timestamp):
+        
+        # one policy_session_<n><timestamp>.npz per session (see policy.py)
+        for session in range(len(self.policies)):
             
-            x_axis = [x for x in range(len(self.session_stock_history[session][0]))]
-            plt.plot(x_axis, self.sim_stock[session], label = "Original without Balancing")
-            plt.plot(x_axis, self.session_stock_history[session][0], label = "Balanced Bike Stock - Eps 0")
-            plt.plot(x_axis, self.session_stock_history[session][-1], 
-                     label = "Balanced Bike Stock - Eps " + str(last_eps_idx))
+            save_policy(self.policies[session], dir_path + "/policy_session_" + \
+                        str(session) + timestamp + ".npz")
+    
+
+    def save_timings(self, dir_path, timestamp):
+        
+        # time per training phase (and profile, if enabled) of every session
+        if len(self.timings) > 0:
+            write_timing_report(dir_path + "/timing - " + timestamp + ".txt",
+                                self.timings, self.episodes, self.method)
+    
+
+    def save_histories(self, dir_path, timestamp):
+        
+        # kept hourly histories as .npy (rows) + _episodes.npy (episode indices)
+        file_path = dir_path + "/history"
+        
+        if not os.path.exists(file_path):
+            os.makedirs(file_path)
+        
+        for session in range(len(self.session_stock_history)):
             
-            plt.axhline(y = 50, c = "r", ls = "-", label = "Upper Stock Limit")
-            plt.axhline(y = 35, c = "m", ls = "--", label = "Upper Target Limit")
-            plt.axhline(y = 15, c = "m", ls = "--", label = "Lower Target Limit")
-            plt.axhline(y = 0, c = "r", ls = "-", label = "Lower Stock Limit")
+            self.session_stock_history[session].save(file_path + "/stocks_session_" + \
+                                                     str(session) + timestamp)
+            if self.session_action_history[session].count > 0:
+                self.session_action_history[session].save(file_path + "/actions_session_" + \
+                                                          str(session) + timestamp)
+    
+
+    def save_session_results_dqn(self, timestamp):
+        dir_path = os.path.join(self.output_dir, timestamp)
+        
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
             
-            plt.legend()
-            plt.xlabel("Hours")
-            plt.ylabel("Number of Bike Stock")
-            plt.title(title)
+        self.save_policies(dir_path, timestamp)
+        self.save_timings(dir_path, timestamp)
+        self.save_histories(dir_path, timestamp)
+        
+        successful_stocking = self.cal_performance()
+        
+        # --- Write Success Rate to File ---
+        self.save_success_rate(dir_path, timestamp, successful_stocking)
+        
+        if self.charts == False:
+            return
+        
+        # matplotlib is only loaded when charts are drawn
+        import report
+
+        # --- Plot Overall Success Rate by Episode ---
+        
+        jobs = [(report.success_rate_chart, (dir_path + "/session_success_rate_" + timestamp, 
+                 self.episodes, successful_stocking, "% of Successful Rebalancing - " + timestamp))]
             
-            fig.savefig(file_path + "/stock_history_" + "DQN" + str(session) + timestamp)
+        # --- Comparison Line Chart of Simulated and Rebalaned Bike Stock --- #
+        
+        jobs += self.stock_history_charts(dir_path, timestamp, "DQN", " Session ")
+        
+        report.render_charts(jobs, self.report_workers)
         
         return
-    
-    